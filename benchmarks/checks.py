@@ -0,0 +1,199 @@
+"""
+Regression checks for behaviour the benchmarks can't see, such as hangs or wrong results on edge cases.
+
+Usage:
+    python benchmarks/checks.py [--only=name,...] [-r=repeat]
+
+Options:
+    --only=<names>  Comma separated check names to run
+    -r=<repeat>     Number of runs of the checks that only fail intermittently (default 10)
+
+Exits with 1 when a check fails.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import generate  # noqa: E402
+
+LGX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log_analyzer.py")
+JAVA_START_REGEX = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"
+TIMEOUT_SECONDS = 30
+
+
+def lgx_command(args):
+    return [sys.executable, LGX, *args]
+
+
+def run(args, input_text):
+    result = subprocess.run(lgx_command(args), input=input_text, capture_output=True, text=True,
+                            timeout=TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise Exception(f"lgx {' '.join(args)} failed: {result.stderr}")
+    return result.stdout
+
+
+def head(args, lines=1, stdin=None):
+    """
+    Read the first lines of a command's output then close the pipe, like `lgx ... | head -1`.
+    Returns the lines read, raises when the command doesn't exit within the timeout.
+    """
+    process = subprocess.Popen(lgx_command(args), stdin=stdin or subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    output = [process.stdout.readline() for _ in range(lines)]
+    process.stdout.close()
+    try:
+        process.wait(TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        raise Exception(f"lgx {' '.join(args)} didn't exit {TIMEOUT_SECONDS}s after its output was closed")
+    return output
+
+
+def check_mul_broken_pipe(workdir, repeat):
+    path = os.path.join(workdir, "java.log")
+    with open(path, "w") as f:
+        f.writelines(generate("java", 100000, multiline_ratio=0.3))
+    for _ in range(repeat):
+        head(["mul", JAVA_START_REGEX, f"--file={path}", "--chunk=64", "--workers=4"])
+
+
+def check_mul_truncation(workdir, repeat):
+    lines = ["START 1", "a" * 48, "bb", "cc", "START 2", "x"]
+    output = run(["mul", "^START", "--max-bytes=20"], "\n".join(lines) + "\n")
+    expected = '{"_line": "START 1", "_truncated": 3}\n{"_line": "START 2\\nx"}\n'
+    if output != expected:
+        raise Exception(f"Expected {expected!r}, got {output!r}")
+
+
+def check_mul_file_crlf(workdir, repeat):
+    path = os.path.join(workdir, "crlf.log")
+    with open(path, "w", newline="") as f:
+        f.write("START 1\r\nat a\r\nSTART 2\r\nline\rwith cr\nSTART 3")
+    with open(path, newline="") as f:
+        expected = run(["mul", "^START"], f.read())
+    output = run(["mul", "^START", f"--file={path}", "--workers=1"], "")
+    if output != expected:
+        raise Exception(f"Expected the stdin output {expected!r}, got {output!r}")
+
+
+def check_mul_file_long_event(workdir, repeat):
+    try:
+        import resource
+    except ImportError:
+        return  # Peak memory of the child processes isn't available on Windows
+    # One event spanning many chunks, only its first --max-bytes should be held in memory
+    path = os.path.join(workdir, "long_event.log")
+    with open(path, "w") as f:
+        f.write("START 0\n")
+        f.writelines(f"    at frame {i}\n" for i in range(4000000))
+        f.write("START 1\n")
+    run(["mul", "^START", f"--file={path}", "--max-bytes=1000", "--chunk=64"], "")
+    peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // 1024
+    if peak_mb > 150:
+        raise Exception(f"Peak memory {peak_mb} MB for a {os.path.getsize(path) // 2 ** 20} MB event")
+
+
+def check_top_mixed_values(workdir, repeat):
+    records = '{"a": "x"}\n{"b": 1}\n{"a": "y"}\n{"a": 1}\n{"a": [1]}\n{"a": [1]}\n'
+    for args in (["top", "a"], ["top", "a", "--exact"], ["rare", "a"]):
+        output = run(args, records)
+        if len(output.splitlines()) != 5:
+            raise Exception(f"lgx {' '.join(args)} expected 5 values, got {output!r}")
+
+
+def check_where_indexed_non_ascii(workdir, repeat):
+    path = os.path.join(workdir, "non_ascii.json")
+    with open(path, "w") as f:
+        f.writelines(json.dumps({"_line": "café au lait" if i == 7 else f"tea {i}"}) + "\n" for i in range(20000))
+    run(["index", "--terms", path, "--block=4"], "")
+    output = run(["where", "'café' in _line", f"--file={path}"], "")
+    if len(output.splitlines()) != 1:
+        raise Exception(f"Expected the record with the non-ASCII literal, got {output!r}")
+
+
+def check_write_bad_cells(workdir, repeat):
+    try:
+        import pyarrow.feather
+    except ImportError:
+        return  # The columnar formats are optional
+    path = os.path.join(workdir, "bad_cells.arrow")
+    records = [{"n": i} for i in range(10)] + [{"n": 2.5}, {"n": "n/a"}, {"n": "7"}, {"n": True}]
+    run(["write", path, "--batch=10"], "".join(json.dumps(r) + "\n" for r in records))
+    values = pyarrow.feather.read_table(path).column("n").to_pylist()
+    if values != list(range(10)) + [None, None, 7, 1]:
+        raise Exception(f"Unexpected values {values}")
+    try:
+        run(["write", path, "--batch=10"], "".join(json.dumps(r) + "\n" for r in records) + "not json\n")
+    except Exception:
+        pass
+    if os.path.exists(path):
+        raise Exception("A failed write left its partial file behind")
+
+
+def check_graph_bins(workdir, repeat):
+    # The first values set the initial range, later ones fall below it
+    records = [{"bytes": 5000 + i} for i in range(1000)] + [{"bytes": 100 + i * 7 % 50000} for i in range(20000)]
+    output = run(["graph", "bytes", "bytes", "--agg=count", "--bins=5"],
+                 "".join(json.dumps(r) + "\n" for r in records))
+    labels = [line.split(" | ")[0].strip() for line in output.splitlines()]
+    if len(labels) != 5 or not labels[0].startswith("[100,"):
+        raise Exception(f"Expected 5 bins starting at 100, got {labels}")
+
+
+def check_cache_live_stream(workdir, repeat):
+    # Like `tail -f app.log | lgx mul ... --cache`: the input stays open, the first record must still come out
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b"START 1\nSTART 2\n")
+    env = dict(os.environ, LGX_CACHE_DIR=os.path.join(workdir, "cache"), LGX_CACHE_IDLE_SECONDS="1")
+    process = subprocess.Popen(lgx_command(["mul", "^START", "--cache"]), stdin=read_fd, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, env=env)
+    os.close(read_fd)
+    try:
+        timer = threading.Timer(TIMEOUT_SECONDS, process.kill)
+        timer.start()
+        line = process.stdout.readline()
+        timer.cancel()
+        if line != b'{"_line": "START 1"}\n':
+            raise Exception(f"Expected the first record while the input is open, got {line!r}")
+    finally:
+        os.close(write_fd)
+        process.stdout.close()
+        process.wait(TIMEOUT_SECONDS)
+
+
+CHECKS = {
+    "mul_broken_pipe": check_mul_broken_pipe,
+    "mul_truncation": check_mul_truncation,
+    "mul_file_long_event": check_mul_file_long_event,
+    "mul_file_crlf": check_mul_file_crlf,
+    "top_mixed_values": check_top_mixed_values,
+    "where_indexed_non_ascii": check_where_indexed_non_ascii,
+    "write_bad_cells": check_write_bad_cells,
+    "graph_bins": check_graph_bins,
+    "cache_live_stream": check_cache_live_stream,
+}
+
+
+def main(args):
+    options = {arg.split("=", 1)[0]: arg.split("=", 1)[1] for arg in args if "=" in arg}
+    names = options["--only"].split(",") if "--only" in options else list(CHECKS)
+    repeat = int(options.get("-r", 10))
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            try:
+                CHECKS[name](workdir, repeat)
+                print(f"ok     {name}")
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {name}: {e}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
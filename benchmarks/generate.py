@@ -0,0 +1,104 @@
+"""
+Synthetic log generator for benchmarks.
+
+Streams access or Java application logs to stdout (or a file) without holding them in memory.
+
+Usage:
+    python benchmarks/generate.py access -n=1000000 > access.log
+    python benchmarks/generate.py java -n=1000000 -c=5000 -m=0.2 -o=app.log
+
+Options:
+    -n=<lines>        Number of log events to generate (default 10000)
+    -c=<cardinality>  Number of distinct values for high cardinality fields such as IPs and URLs (default 1000)
+    -m=<ratio>        Ratio of Java events carrying a multiline stack trace (default 0.1)
+    -s=<seed>         Random seed, the same seed always produces the same log (default 42)
+    -o=<path>         Output file, defaults to stdout
+"""
+import random
+import sys
+from datetime import datetime, timedelta
+
+METHODS = ["GET", "GET", "GET", "POST", "PUT", "DELETE"]
+STATUSES = [200, 200, 200, 200, 201, 204, 301, 400, 401, 403, 404, 500, 503]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)",
+    "Mozilla/5.0 (Linux; Android 11)",
+    "PostmanRuntime/7.29.0",
+    "curl/7.68.0"
+]
+LEVELS = ["INFO", "INFO", "INFO", "DEBUG", "WARN", "ERROR"]
+THREADS = ["main", "worker-1", "worker-2", "scheduler", "http-nio-8080-exec-1"]
+MESSAGES = [
+    "Background job executed",
+    "Connecting to database...",
+    "User login successful user_id={}",
+    "Cache miss, querying DB for key={}",
+    "Health check passed",
+    "Fetching data from API /api/items/{}",
+    "Request completed in {} ms"
+]
+EXCEPTIONS = [
+    ("java.sql.SQLException: Connection timed out", "com.example.db.Database.connect(Database.java:88)"),
+    ("java.lang.NullPointerException", "com.example.service.UserService.load(UserService.java:42)"),
+    ("java.io.IOException: Broken pipe", "com.example.http.Client.send(Client.java:131)")
+]
+START_TIME = datetime(2025, 7, 17)
+
+
+def access_lines(count, cardinality, rng):
+    ts = START_TIME
+    for _ in range(count):
+        ts += timedelta(milliseconds=rng.randint(0, 2000))
+        ip_id = rng.randint(0, cardinality - 1)
+        ip = f"10.{ip_id >> 16 & 255}.{ip_id >> 8 & 255}.{ip_id & 255}"
+        path = f"/api/resource/{rng.randint(0, cardinality - 1)}"
+        yield (f'{ip} - - [{ts:%d/%b/%Y:%H:%M:%S} +0000] "{rng.choice(METHODS)} {path} HTTP/1.1" '
+               f'{rng.choice(STATUSES)} {rng.randint(100, 50000)} "{rng.choice(USER_AGENTS)}"\n')
+
+
+def java_lines(count, cardinality, multiline_ratio, rng):
+    ts = START_TIME
+    for _ in range(count):
+        ts += timedelta(milliseconds=rng.randint(0, 2000))
+        message = rng.choice(MESSAGES).format(rng.randint(0, cardinality - 1))
+        yield f"{ts:%Y-%m-%d %H:%M:%S} {rng.choice(LEVELS)} [{rng.choice(THREADS)}] - {message}\n"
+        if rng.random() < multiline_ratio:
+            exception, frame = rng.choice(EXCEPTIONS)
+            yield f"\t{exception}\n"
+            yield f"\t\tat {frame}\n"
+            for depth in range(rng.randint(1, 8)):
+                yield f"\t\tat com.example.App.step{depth}(App.java:{10 + depth})\n"
+
+
+def generate(kind, count=10000, cardinality=1000, multiline_ratio=0.1, seed=42):
+    rng = random.Random(seed)
+    if kind == "access":
+        return access_lines(count, cardinality, rng)
+    if kind == "java":
+        return java_lines(count, cardinality, multiline_ratio, rng)
+    raise Exception(f"Unknown log kind: {kind}, expected access or java")
+
+
+def main(args):
+    if not args or args[0] not in ("access", "java"):
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    options = {arg.split("=", 1)[0]: arg.split("=", 1)[1] for arg in args[1:] if "=" in arg}
+    lines = generate(
+        args[0],
+        count=int(float(options.get("-n", 10000))),
+        cardinality=int(float(options.get("-c", 1000))),
+        multiline_ratio=float(options.get("-m", 0.1)),
+        seed=int(options.get("-s", 42))
+    )
+    out = open(options["-o"], "w") if "-o" in options else sys.stdout
+    try:
+        out.writelines(lines)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,339 @@
+"""
+Benchmark suite for the log analyzer commands.
+
+Generates synthetic access and Java logs, runs every command and a few representative pipelines
+against them, and reports wall time, records/s, peak RSS and a per-stage breakdown as JSON.
+
+Usage:
+    python benchmarks/run.py [-n=lines] [-c=cardinality] [-m=multiline_ratio] [--only=name,...]
+                             [--baseline=path] [--save-baseline=path] [-t=tolerance] [-o=results_path]
+                             [--workdir=path]
+
+Options:
+    -n=<lines>             Number of generated log events (default 10000)
+    -c=<cardinality>       Distinct IPs/URLs/ids in the generated logs (default 1000)
+    -m=<ratio>             Ratio of Java events with stack traces (default 0.1)
+    --only=<names>         Comma separated benchmark names to run
+    --baseline=<path>      Compare against a stored results file, exits with 1 on regressions
+    --save-baseline=<path> Store the results as a new baseline
+    -t=<tolerance>         Allowed slowdown against the baseline before it's reported as a regression (default 0.2)
+    -o=<path>              Write the results to a file instead of stdout
+    --workdir=<path>       Keep generated inputs and outputs in this directory instead of a temporary one
+"""
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import START_TIME, generate  # noqa: E402
+
+LGX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log_analyzer.py")
+
+ACCESS_REGEX = (r'(?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\s+-\s+-\s+\[(?P<timestamp>[^\]]+)\]\s+'
+                r'"(?P<method>GET|POST|PUT|DELETE)\s+(?P<path>[^\s]+)\s+HTTP/\d\.\d"\s+(?P<status>\d{3})\s+'
+                r'(?P<bytes>\d+)\s+"(?P<user_agent>[^"]+)"')
+JAVA_START_REGEX = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"
+JAVA_TIME_OPTIONS = [r"--time-regex=^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})", "--time-format=%Y-%m-%d %H:%M:%S"]
+JAVA_REGEX = r"^(?P<timestamp>\S+ \S+) (?P<level>[A-Z]+) \[(?P<thread>[^\]]+)\] - (?P<message>[^\n]*)"
+
+# IOC style terms for match --any, to measure how matching scales with the number of terms
+MATCH_ANY_TERMS = [f"10.0.{i % 256}.{i * 7 % 256}" if i % 2 else f"/api/resource/{i * 37} " for i in range(1000)]
+
+# Quadratic commands are run on a prefix of the input so that large runs still finish
+QUADRATIC_MAX_LINES = 2000
+
+BENCHMARKS = [
+    {"name": "match", "input": "access", "stages": [["match", "POST /api"]]},
+    {"name": "match_any", "input": "access", "stages": [["match", "--any", "POST", "DELETE", "curl"]]},
+    {"name": "match_any_1000", "input": "access", "stages": [["match", "--any", *MATCH_ANY_TERMS]]},
+    {"name": "highlight", "input": "access", "stages": [["highlight", "GET", "POST", "500"]]},
+    {"name": "match_file", "input": "access", "stages": [["match", "POST /api", "--file={input}"]]},
+    {"name": "match_file_indexed", "input": "access_json_indexed",
+     "stages": [["match", "/api/resource/17 ", "--file={input}"]]},
+    {"name": "rex", "input": "access", "stages": [["rex", ACCESS_REGEX]]},
+    {"name": "mul", "input": "java", "stages": [["mul", JAVA_START_REGEX]]},
+    {"name": "mul_file", "input": "java", "stages": [["mul", JAVA_START_REGEX, "--file={input}"]]},
+    {"name": "where", "input": "access_json", "stages": [["where", "status >= 400"]]},
+    {"name": "where_file_indexed", "input": "access_json_indexed",
+     "stages": [["where", "method == 'DELETE' and status >= 500", "--file={input}"]]},
+    {"name": "eval", "input": "access_json", "stages": [["eval", "kb = bytes / 1024"]]},
+    {"name": "fields", "input": "access_json", "stages": [["fields", "ip", "path", "status"]]},
+    {"name": "sort", "input": "access_json", "stages": [["sort", "-bytes", "+ip"]]},
+    {"name": "reverse", "input": "access_json", "stages": [["reverse"]]},
+    {"name": "count", "input": "access_json", "stages": [["count"]]},
+    {"name": "group", "input": "access_json", "stages": [["group", "ip"]]},
+    {"name": "geval", "input": "access_grouped", "stages": [["geval", "errors = sum(1 for s in status if s >= 400)"]]},
+    {"name": "streamstats", "input": "access_json", "stages": [["streamstats", "avg(bytes)", "max(bytes)", "by", "ip", "-w=100"]]},
+    {"name": "accum", "input": "access_json", "stages": [["accum", "bytes"]]},
+    {"name": "table", "input": "access_json", "stages": [["table", "ip", "method", "path", "status"]]},
+    {"name": "json", "input": "access_json", "stages": [["json"]]},
+    {"name": "json_stream", "input": "access_json", "stages": [["json", "--stream"]]},
+    {"name": "csv", "input": "access_json", "stages": [["csv"]]},
+    {"name": "lookup", "input": "access_json", "stages": [["lookup", "ip", "{lookup_command}"]]},
+    {"name": "enrich", "input": "access_json", "stages": [["enrich", "ip", "echo", "--as=echoed"]]},
+    {"name": "graph", "input": "access_json", "stages": [["graph", "status", "bytes", "80"]]},
+    {"name": "graph_top", "input": "access_json", "stages": [["graph", "path", "bytes", "80", "-n=20"]]},
+    {"name": "graph_bins", "input": "access_json", "stages": [["graph", "bytes", "bytes", "80", "--agg=count", "--bins=20"]]},
+    {"name": "write_jsonl_gz", "input": "access_json", "stages": [["write", "-", "--format=jsonl.gz"]]},
+    {"name": "write_jsonl_zst", "input": "access_json", "stages": [["write", "-", "--format=jsonl.zst"]],
+     "requires": ["compression.zstd", "zstandard"]},
+    {"name": "write_arrow", "input": "access_json", "stages": [["write", "-", "--format=arrow"]],
+     "requires": ["pyarrow"]},
+    {"name": "write_parquet", "input": "access_json", "stages": [["write", "-", "--format=parquet"]],
+     "requires": ["pyarrow"]},
+    {"name": "dc", "input": "access_json", "stages": [["dc", "ip", "path"]]},
+    {"name": "top", "input": "access_json", "stages": [["top", "path", "-n=20"]]},
+    {"name": "rare", "input": "access_json", "stages": [["rare", "path", "-n=20"]]},
+    {"name": "sample", "input": "access", "stages": [["sample", "-n=1000", "--seed=1"]]},
+    {"name": "gen", "input": "access", "stages": [["gen", "({'id': i, 'value': i * 2} for i in range({lines}))"]]},
+    {"name": "index", "input": "java", "stages": [["index", "{input}", *JAVA_TIME_OPTIONS]]},
+    {"name": "index_terms", "input": "java", "stages": [["index", "--terms", "{input}"]]},
+    {"name": "read", "input": "java_indexed", "stages": [["read", "{input}", "--from={read_from}"]]},
+    {"name": "dedup", "input": "access_json", "stages": [["dedup", "ip"]], "max_lines": QUADRATIC_MAX_LINES},
+    {"name": "cluster", "input": "java_json", "stages": [["cluster", "message", "-t=0.9"]],
+     "max_lines": QUADRATIC_MAX_LINES},
+    {"name": "pipeline_access_report", "input": "access", "stages": [
+        ["rex", ACCESS_REGEX],
+        ["eval", "status = int(status); bytes = int(bytes)"],
+        ["group", "status"],
+        ["geval", "count = len(_grouped); max_kb = max(r['bytes'] for r in _grouped) / 1024"],
+        ["fields", "status", "count", "max_kb"],
+        ["sort", "-count"],
+        ["table"]
+    ]},
+    {"name": "pipeline_java_errors", "input": "java", "stages": [
+        ["mul", JAVA_START_REGEX],
+        ["rex", JAVA_REGEX, "-i=_line"],
+        ["where", "level == 'ERROR'"],
+        ["fields", "timestamp", "thread", "message"]
+    ]},
+]
+
+
+def any_importable(modules):
+    for module in modules:
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+def lgx_command(args):
+    return [sys.executable, LGX, *args]
+
+
+def run_process(command, input_path, output_path):
+    """
+    Run a command with the input file as stdin and the output file as stdout.
+    Returns the wall time in seconds and the peak RSS of the process in KB (None where unsupported).
+    """
+    with open(input_path, "rb") as stdin, open(output_path, "wb") as stdout:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE)
+        if hasattr(os, "wait4"):
+            stderr = process.stderr.read()
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") \
+                else status >> 8
+            peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+        else:
+            _, stderr = process.communicate()
+            peak_rss_kb = None
+        seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception(f"Command failed: {' '.join(command)}\n{stderr.decode('utf-8', errors='replace')}")
+    return seconds, peak_rss_kb
+
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def head_file(path, max_lines, output_path):
+    with open(path, "rb") as f, open(output_path, "wb") as out:
+        for i, line in enumerate(f):
+            if i >= max_lines:
+                break
+            out.write(line)
+    return output_path
+
+
+def prepare_inputs(workdir, lines, cardinality, multiline_ratio):
+    inputs = {}
+    for kind in ("access", "java"):
+        path = os.path.join(workdir, f"{kind}.log")
+        with open(path, "w") as f:
+            f.writelines(generate(kind, lines, cardinality, multiline_ratio))
+        inputs[kind] = path
+
+    inputs["access_json"] = os.path.join(workdir, "access.json")
+    extracted = os.path.join(workdir, "access_extracted.json")
+    run_process(lgx_command(["rex", ACCESS_REGEX]), inputs["access"], extracted)
+    run_process(lgx_command(["eval", "status = int(status); bytes = int(bytes)"]), extracted, inputs["access_json"])
+
+    inputs["access_grouped"] = os.path.join(workdir, "access_grouped.json")
+    run_process(lgx_command(["group", "ip"]), inputs["access_json"], inputs["access_grouped"])
+
+    inputs["java_json"] = os.path.join(workdir, "java.json")
+    multiline = os.path.join(workdir, "java_mul.json")
+    run_process(lgx_command(["mul", JAVA_START_REGEX]), inputs["java"], multiline)
+    run_process(lgx_command(["rex", JAVA_REGEX, "-i=_line"]), multiline, inputs["java_json"])
+
+    # Copies with a term or time index, so that the index benchmarks don't change the other benchmarks
+    inputs["access_json_indexed"] = os.path.join(workdir, "access_indexed.json")
+    shutil.copyfile(inputs["access_json"], inputs["access_json_indexed"])
+    run_process(lgx_command(["index", "--terms", inputs["access_json_indexed"]]), inputs["access"], os.devnull)
+    inputs["java_indexed"] = os.path.join(workdir, "java_indexed.log")
+    shutil.copyfile(inputs["java"], inputs["java_indexed"])
+    run_process(lgx_command(["index", inputs["java_indexed"], *JAVA_TIME_OPTIONS]), inputs["java"], os.devnull)
+    # Java events are one second apart on average, read the second half of the log
+    inputs["read_from"] = f"{START_TIME + timedelta(seconds=lines // 2):%Y-%m-%d %H:%M:%S}"
+    inputs["lines"] = str(lines)
+
+    lookup_path = os.path.join(workdir, "lookup.json")
+    with open(lookup_path, "w") as f:
+        json.dump([{"ip": f"10.0.{i >> 8 & 255}.{i & 255}", "name": f"host-{i}"} for i in range(cardinality)], f)
+    inputs["lookup_command"] = " ".join(shlex.quote(part) for part in [
+        sys.executable, "-c", "import sys; sys.stdout.write(open(sys.argv[1]).read())", lookup_path])
+    return inputs
+
+
+def fill_placeholders(arg, inputs, stage_input):
+    """
+    Replace {input} with the stage input and {name} with the prepared input of that name, e.g. {lookup_command}.
+    """
+    arg = arg.replace("{input}", stage_input)
+    for name, value in inputs.items():
+        arg = arg.replace("{" + name + "}", value)
+    return arg
+
+
+def run_benchmark(benchmark, inputs, workdir):
+    input_path = inputs[benchmark["input"]]
+    if benchmark.get("max_lines"):
+        input_path = head_file(input_path, benchmark["max_lines"],
+                               os.path.join(workdir, f"{benchmark['name']}_input.txt"))
+    records_in = count_lines(input_path)
+    stages = []
+    stage_input = input_path
+    for i, stage_args in enumerate(benchmark["stages"]):
+        stage_args = [fill_placeholders(arg, inputs, stage_input) for arg in stage_args]
+        stage_output = os.path.join(workdir, f"{benchmark['name']}_stage{i}.txt")
+        seconds, peak_rss_kb = run_process(lgx_command(stage_args), stage_input, stage_output)
+        stage_records_in = count_lines(stage_input)
+        stages.append({
+            "command": stage_args[0],
+            "seconds": round(seconds, 4),
+            "records_in": stage_records_in,
+            "records_out": count_lines(stage_output),
+            "records_per_sec": round(stage_records_in / seconds, 1) if seconds else None,
+            "peak_rss_kb": peak_rss_kb
+        })
+        stage_input = stage_output
+    seconds = sum(stage["seconds"] for stage in stages)
+    rss_values = [stage["peak_rss_kb"] for stage in stages if stage["peak_rss_kb"] is not None]
+    return {
+        "seconds": round(seconds, 4),
+        "records_in": records_in,
+        "records_out": stages[-1]["records_out"],
+        "records_per_sec": round(records_in / seconds, 1) if seconds else None,
+        "peak_rss_kb": max(rss_values) if rss_values else None,
+        "stages": stages
+    }
+
+
+def compare(results, baseline, tolerance):
+    comparison = {}
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("seconds"):
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        comparison[name] = {
+            "baseline_seconds": base["seconds"],
+            "seconds": result["seconds"],
+            "ratio": round(ratio, 3),
+            "regression": ratio > 1 + tolerance
+        }
+    return comparison
+
+
+def main(args):
+    if "-h" in args or "--help" in args:
+        print(__doc__)
+        return 0
+    options = {arg.split("=", 1)[0]: arg.split("=", 1)[1] for arg in args if "=" in arg}
+    lines = int(float(options.get("-n", 10000)))
+    cardinality = int(float(options.get("-c", 1000)))
+    multiline_ratio = float(options.get("-m", 0.1))
+    only = set(options["--only"].split(",")) if "--only" in options else None
+
+    workdir = options.get("--workdir")
+    temp_dir = None
+    if workdir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="lgx-bench-")
+        workdir = temp_dir.name
+    os.makedirs(workdir, exist_ok=True)
+
+    try:
+        inputs = prepare_inputs(workdir, lines, cardinality, multiline_ratio)
+        results = {}
+        for benchmark in BENCHMARKS:
+            if only is not None and benchmark["name"] not in only:
+                continue
+            if benchmark.get("requires") and not any_importable(benchmark["requires"]):
+                # Optional dependencies of lgx, e.g. pyarrow for the columnar formats
+                print(f"Skipping {benchmark['name']}, it needs {' or '.join(benchmark['requires'])}", file=sys.stderr)
+                continue
+            print(f"Running {benchmark['name']}...", file=sys.stderr)
+            results[benchmark["name"]] = run_benchmark(benchmark, inputs, workdir)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    report = {
+        "meta": {
+            "lines": lines,
+            "cardinality": cardinality,
+            "multiline_ratio": multiline_ratio,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.now().isoformat(timespec="seconds")
+        },
+        "results": results
+    }
+
+    exit_code = 0
+    if "--baseline" in options:
+        with open(options["--baseline"]) as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(results, baseline, float(options.get("-t", 0.2)))
+        if any(c["regression"] for c in report["comparison"].values()):
+            exit_code = 1
+
+    if "--save-baseline" in options:
+        with open(options["--save-baseline"], "w") as f:
+            json.dump(report, f, indent=2)
+
+    output = json.dumps(report, indent=2)
+    if "-o" in options:
+        with open(options["-o"], "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
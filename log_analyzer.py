@@ -1,17 +1,54 @@
+import ast
+import atexit
+import base64
+import bisect
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import math
+import os
 import random
 import re
+import shlex
+import shutil
+import stat
 import subprocess
+import tempfile
 import sys
+import time
 import urllib.request
+import zlib
+from array import array
+from collections import Counter
 from collections import OrderedDict
 from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from datetime import *
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from difflib import SequenceMatcher
 from enum import Enum
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import select
+except ImportError:
+    select = None
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
 
 def percentile(data, p):
     """
@@ -55,8 +92,8 @@ def percentile(data, p):
 
 
 EXEC_UTIL_FUNCS = {
-    'strptime': lambda date_str, fmt="%Y-%m-%d %H:%M:%S": datetime.strptime(date_str, fmt).timestamp() * 1000,
-    'strftime': lambda dt, fmt="%Y-%m-%d %H:%M:%S": datetime.fromtimestamp(dt / 1000).strftime(fmt),
+    'strptime': lambda date_str, fmt="%Y-%m-%d %H:%M:%S": parse_timestamp(date_str, fmt),
+    'strftime': lambda dt, fmt="%Y-%m-%d %H:%M:%S": format_timestamp(dt, fmt),
     'perc': percentile,
     'avg': lambda data: sum(data) / len(data),
     'iif': lambda cond, true_val, false_val: true_val if cond else false_val,
@@ -65,10 +102,87 @@ EXEC_UTIL_FUNCS = {
 }
 BUILTINS = __builtins__
 CONCURRENT_THREAD_COUNT = 20
+DEFAULT_ENRICH_CACHE_SIZE = 100000
+# Records waiting for their enrichment per worker thread, bounds memory while keeping the output order
+ENRICH_PENDING_PER_THREAD = 64
+MISSING = object()
 
 GROUPED_KEY = "_grouped"
 LINE_KEY = "_line"
 CLUSTER_RATIO_KEY = "_cluster_ratio"
+TRUNCATED_KEY = "_truncated"
+DEFAULT_MUL_CHUNK_KB = 4096
+
+TIME_INDEX_SUFFIX = ".lgxidx"
+TIME_INDEX_VERSION = 2
+TIME_INDEX_HEAD_BYTES = 4096
+TIME_INDEX_SETTINGS = ("time_regex", "time_format", "every", "mul")
+DEFAULT_INDEX_EVERY_KB = 64
+STATS = None
+
+DEFAULT_HLL_PRECISION = 14
+DEFAULT_TOP_LIMIT = 10
+SKETCH_CAPACITY_FACTOR = 10
+MIN_SKETCH_CAPACITY = 1000
+HLL_KEY = "_hll"
+
+DEFAULT_TIME_FIELD = "ts"
+DURATION_UNITS_MS = {"ms": 1, "s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000}
+DEFAULT_SAMPLE_BLOCK_KB = 64
+MIN_SAMPLE_BLOCKS = 100
+MAX_INTERNED_VALUES_PER_COLUMN = 10000
+MAX_TIMESTAMP_CACHE_SIZE = 65536
+CACHE_DIR = os.environ.get("LGX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "lgx"))
+DEFAULT_CACHE_SIZE_MB = int(os.environ.get("LGX_CACHE_SIZE_MB", 1024))
+CACHE_SUFFIX = ".jsonl.gz"
+# Piped input that pauses this long after its first data is a live stream (e.g. tail -f), it isn't cached
+CACHE_IDLE_SECONDS = float(os.environ.get("LGX_CACHE_IDLE_SECONDS", 2))
+# Commands with side effects or without a stable output are never cached
+UNCACHED_COMMANDS = {"help", "upgrade", "index", "cache", "write"}
+# Commands that never read stdin
+NO_INPUT_COMMANDS = {"gen", "read"}
+MONTH_NAMES = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+FULL_MONTH_NAMES = ["january", "february", "march", "april", "may", "june", "july", "august", "september",
+                    "october", "november", "december"]
+TIMESTAMP_DIRECTIVES = {
+    "Y": r"(?P<Y>\d{4})",
+    "y": r"(?P<y>\d{2})",
+    "m": r"(?P<m>\d{1,2})",
+    "d": r"(?P<d>\d{1,2})",
+    "H": r"(?P<H>\d{1,2})",
+    "I": r"(?P<I>\d{1,2})",
+    "M": r"(?P<M>\d{1,2})",
+    "S": r"(?P<S>\d{1,2})",
+    "f": r"(?P<f>\d{1,6})",
+    "b": r"(?P<b>[a-z]{3})",
+    "B": r"(?P<B>[a-z]+)",
+    "p": r"(?P<p>am|pm)",
+    "z": r"(?P<z>z|[+-]\d{2}:?\d{2})",
+    "a": r"[a-z]+",
+    "A": r"[a-z]+",
+    "%": "%"
+}
+GRAPH_AGGREGATES = ["sum", "avg", "max", "min", "count", "last"]
+# Fine slots per drawn histogram bin, the range can grow 2^6 times before a bin is only one slot wide
+GRAPH_BIN_RESOLUTION = 64
+STREAM_AGGREGATES = ["count", "sum", "avg", "min", "max", "rate", "derivative"]
+
+DEFAULT_SINK_BATCH_ROWS = 65536
+# Output formats by file name suffix, checked in order
+SINK_FORMATS = [
+    (".jsonl.gz", "jsonl.gz"), (".json.gz", "jsonl.gz"), (".gz", "jsonl.gz"),
+    (".jsonl.zst", "jsonl.zst"), (".json.zst", "jsonl.zst"), (".zst", "jsonl.zst"),
+    (".arrow", "arrow"), (".feather", "arrow"), (".ipc", "arrow"),
+    (".parquet", "parquet"),
+    (".jsonl", "jsonl"), (".ndjson", "jsonl"), (".json", "jsonl")
+]
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+
+TERM_INDEX_SUFFIX = ".lgxterms"
+TERM_INDEX_VERSION = 1
+DEFAULT_TERM_BLOCK_KB = 64
+TOKEN_REGEX = re.compile(r"\w+")
 
 
 class Colors(Enum):
@@ -119,18 +233,33 @@ This tool allows advanced log processing and manipulation using various commands
 Commands:
 ---------
 
-1. match <regex>
+1. match <regex> | match --any <terms> | match -f <patterns_file>
    - Filters logs that match the given regular expression.
+   - With --any, keeps logs containing any of the given literal terms.
+   - With -f, the literal terms are read from a file, one per line.
+   - All terms are combined into a single trie shaped pattern where shared prefixes are matched once, so the time
+     barely depends on the number of terms (100k access log lines: ~0.2s for 10, 1000 or 10000 IP/URL terms).
+   - With --file=<path> (repeatable), reads the files directly. If a file has an up to date term index (see index --terms),
+     only the blocks that can contain the literals required by the regex are read. --any and -f read the whole files.
    - Example:
      cat server.log | lgx match "Access"
-
-2. rex <regex> [-i=field_name]
+   - Search a file using its term index:
+     lgx match "Connection timed out" --file=app.log
+   - Match any of several literal terms:
+     cat server.log | lgx match --any ERROR FATAL Timeout
+   - Match a list of IOC strings:
+     cat access.log | lgx match -f iocs.txt
+
+2. rex <regex> [-i=field_name] [--ts=format]
    - Extracts fields from log lines using a named-group regular expression and appends these fields as JSON.
    - The -i parameter allows you to apply the regex to a specific field in the JSON data instead of the entire line.
+   - The --ts parameter parses the extracted "ts" group with the given strptime format into epoch milliseconds.
    - Example:
      cat server.log | lgx rex "(?P<url>[A-Z]+ \S+)"
    - Extract fields from specific input field in JSON data:
      cat server.log | lgx rex "(?P<method>[A-Z]+)" -i=request
+   - Extract the timestamp as epoch milliseconds:
+     cat access.log | lgx rex "\[(?P<ts>[^\]]+)\]" --ts="%d/%b/%Y:%H:%M:%S %z"
 
 3. where <expression>
    - Filters logs based on the provided Python expression.
@@ -139,6 +268,8 @@ Commands:
      cat server.log | lgx where "'GET' in url"
    - Filter logs by numerical comparison:
      cat server.log | lgx where "response_time > 200"
+   - With --file=<path> (repeatable), reads JSON lines files directly. "'text' in _line" conditions use the term index of the file when available:
+     lgx where "'timed out' in _line and level == 'ERROR'" --file=app.json
 
 4. group <fields>
    - Groups logs by the specified keys, storing all grouped logs under a _grouped key.
@@ -196,11 +327,14 @@ Commands:
     - Example:
       cat server.log | lgx table
 
-12. json
+12. json [--stream]
     - Outputs the log data as a single JSON array.
     - Useful for further processing with other JSON tools.
+    - The --stream parameter writes the array incrementally, one element per line, instead of building it in memory.
     - Example:
       cat server.log | lgx json
+    - Convert a large log without holding it in memory:
+      cat server.json | lgx json --stream > server_array.json
 
 13. lookup <field> <lookup_data_command> [join_type]
     - Joins log data with lookup data based on a common field.
@@ -213,15 +347,30 @@ Commands:
     - Using different join types:
       cat logs.json | lgx lookup user_id 'echo "[{\"user_id\": 123, \"name\": \"John\"}]"' inner
 
-14. graph <x_fields> <y_fields> [width]
+14. graph <x_fields> <y_fields> [width] [--agg=aggregate] [-n=limit [--exact]] [--bins=N] [--live[=secs]]
     - Creates an ASCII bar graph visualization of the data.
     - Multiple x_fields and y_fields can be specified as comma-separated values.
     - Different y_fields are displayed with different colors for easy distinction.
     - The optional width parameter controls the maximum width of the bars.
+    - Records with the same label are aggregated while reading with --agg: sum (default), avg, max, min, count or
+      last. Values that aren't finite numbers are ignored.
+    - The -n parameter only draws the labels with the highest value of the first y field. With sum or count, only
+      max(10 x limit, 1000) labels are kept in memory (Space-Saving): labels that only become frequent late in a
+      large stream may be missing or undercounted. --exact keeps every label, as the other aggregates always do.
+    - The --bins parameter draws a histogram of a numeric x field in N bins from its smallest to its largest value.
+      Values are counted in 64 finer slots per bin that widen as values fall outside their range, so memory stays
+      bounded whatever the number of distinct values. Bin widths can differ by one slot.
+    - The --live parameter redraws the graph every secs seconds (default 1) while the input is streamed.
     - Example:
       cat stats.json | lgx graph timestamp,service response_time 80
     - Multiple y-fields with color coding:
       cat stats.json | lgx graph service errors,warnings,info 100
+    - Average response time of the 20 slowest services:
+      cat stats.json | lgx graph service response_time --agg=avg -n=20
+    - Histogram of response sizes:
+      cat access.json | lgx graph bytes bytes --agg=count --bins=20
+    - Live request counts per status:
+      tail -f access.log | lgx rex "(?P<status>\d{3}) \d+" | lgx graph status status --agg=count --live=2
 
 15. cluster <field> [-t=threshold]
     - Groups similar logs based on the similarity of the specified field.
@@ -233,21 +382,37 @@ Commands:
     - Lower threshold for more inclusive clustering:
       cat logs.json | lgx cluster message -t=0.6
 
-16. mul <regex>
+16. mul <regex> [--ts=format] [--max-lines=N] [--max-bytes=N] [--file=path ... --workers=N --chunk=KB]
     - Resolves multiline log entries based on a starting line pattern.
     - Combines lines that don't match the pattern with the previous matching line.
+    - The --ts parameter adds a "ts" field with the epoch milliseconds of each entry, parsed with the given strptime
+      format from the "ts" group of the pattern, its first group, or the whole match.
+    - --max-lines and --max-bytes cap the size of an entry, further lines are dropped and their count is
+      stored in a "_truncated" field. Sizes are counted in characters, the first line is always kept whole.
+    - Patterns anchored with ^ are only tried at the line start, after a quick check of their literal prefix.
+    - With --file the files are read directly and split into chunks of about --chunk KB (default 4096), each
+      realigned to the next line matching the pattern. Chunks are processed by --workers processes (default:
+      CPU count) and the entries are written in file order.
     - Example:
       cat app.log | lgx mul "^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\]"
     - Process Java stack traces:
       cat java.log | lgx mul "^[0-9]{4}-[0-9]{2}-[0-9]{2}"
+    - Resolve multiline entries and parse their timestamps:
+      cat java.log | lgx mul "^[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}" --ts="%Y-%m-%d %H:%M:%S"
+    - Resolve a large file in parallel, keeping at most 200 lines per entry:
+      lgx mul "^[0-9]{4}-[0-9]{2}-[0-9]{2}" --file=java.log --workers=4 --max-lines=200
 
 17. gen <expression>
     - Generates data from Python expression and outputs as JSON lines.
     - Useful for creating test data or sample inputs.
+    - Lists, ranges and generator expressions output one line per item. Generators and ranges are streamed,
+      so large data sets are never held in memory.
     - Example:
       lgx gen "[{'id':i, 'value':i*2} for i in range(5)]"
     - Generate more complex test data:
       lgx gen "[{'timestamp': f'2023-01-{i:02d}', 'count': i*10} for i in range(1, 31)]"
+    - Stream a large data set:
+      lgx gen "({'id': i} for i in range(10**8))"
 
 18. dedup <fields>
     - Removes duplicate entries based on the specified fields.
@@ -260,6 +425,7 @@ Commands:
 19. accum <fields>
     - Accumulates values for specified numeric fields across JSON log entries.
     - Maintains a running total for each field and updates each log entry with the accumulated value.
+    - Missing values count as 0. See streamstats for windowed and per-key aggregates.
     - Example:
       cat metrics.json | lgx accum count
     - Accumulate multiple fields:
@@ -284,11 +450,157 @@ Commands:
     - Highlights specified text in each log line with different colors.
     - Multiple text strings can be provided, each will be highlighted with a different color.
     - Colors cycle through cyan, yellow, magenta, green, blue, and red if more than 6 text strings are provided.
+    - All terms are matched in a single left-to-right scan; overlapping terms prefer the longest match.
     - Example:
       cat server.log | lgx highlight ERROR WARNING
     - Highlight multiple terms with different colors:
       cat app.log | lgx highlight exception error warning
 
+23. index <file> --time-regex=<regex> --time-format=<format> [--every=KB] [--mul=<regex>]
+    - Builds a sparse sidecar time index (<file>.lgxidx) mapping timestamps to byte offsets, one entry every N KB (default 64).
+    - The timestamp is taken from the named group "ts", the first group, or the whole match of the time regex.
+    - The optional --mul pattern restricts index entries to lines that start a multiline event.
+    - Running it again on an appended file only scans the new data. The index is rebuilt if the file was replaced,
+      truncated or rewritten (checked with its inode, size, modification time and first 4 KB), or the settings changed.
+    - Example:
+      lgx index app.log --time-regex="^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})" --time-format="%Y-%m-%d %H:%M:%S"
+
+    index --terms <files> [--block=KB]
+    - Builds an inverted index (<file>.lgxterms) of word tokens to line aligned blocks of N KB (default 64) for each file.
+    - Used automatically by match/where with --file. Regexes without required literals and stale indexes fall back to a full scan.
+    - Example:
+      lgx index --terms app.log access.log
+
+24. read <file> [--from=time] [--to=time]
+    - Reads a file, optionally restricted to a time range using its time index.
+    - Times are given in the index time format or as epoch milliseconds.
+    - Seeks directly to the closest indexed offset instead of scanning from the start; assumes timestamps are in time order.
+    - A stale index, e.g. after the file was rotated, is rebuilt with a warning before reading.
+    - Lines without a timestamp (e.g. stack traces) are kept with the preceding event.
+    - Example:
+      lgx read app.log --from="2025-07-18 00:00:00" --to="2025-07-18 06:00:00" | lgx mul "^[0-9]{4}-[0-9]{2}-[0-9]{2}"
+
+25. dc <fields> [-p=precision] [--exact] [--sketch] | dc --merge
+    - Counts the distinct values of each field using a HyperLogLog sketch, in constant memory regardless of the input size.
+    - The precision parameter (4-18, default 14) sets the sketch size to 2^precision bytes; precision 14 uses 16 KB with ~0.8% standard error.
+    - --exact counts the distinct values exactly, keeping every distinct value in memory.
+    - --sketch includes the sketch in the output, and dc --merge merges such sketches, e.g. computed over different files.
+    - Example:
+      cat logs.json | lgx dc ip
+    - Merge distinct counts computed separately:
+      cat day1.json | lgx dc ip --sketch > s1.json; cat day2.json | lgx dc ip --sketch > s2.json; cat s1.json s2.json | lgx dc --merge
+
+26. top <fields> [-n=limit] [--exact] | rare <fields> [-n=limit] [--exact]
+    - Outputs the most (top) or least (rare) frequent values of the specified fields with their counts, 10 by default.
+    - top uses a Space-Saving sketch and rare a Count-Min sketch, so memory stays bounded for any number of distinct values.
+    - Approximate top counts may be overestimated by at most count_error.
+    - --exact counts every distinct value exactly, keeping them all in memory.
+    - Example:
+      cat logs.json | lgx top url -n=20
+    - Least frequent status and method combinations:
+      cat logs.json | lgx rare status method -n=5 --exact
+
+27. streamstats <aggregates> [by <fields>] [-w=window] [--time=field]
+    - Adds running aggregates to each log entry as it streams through, without buffering the input.
+    - Aggregates: count(), count(field), sum(field), avg(field), min(field), max(field), rate(), rate(field), derivative(field). Use as name to rename the output field.
+    - by computes the aggregates separately per combination of the given fields.
+    - The window is either a number of records (e.g. -w=100) or a duration (e.g. -w=30s, -w=5m, -w=1h) over the epoch ms time field (default ts, set with --time). Without a window the aggregates cover all previous records.
+    - rate() is records per second, rate(field) is the increase of the field per second over the window, and derivative(field) is the change per second from the previous record.
+    - Non-numeric and missing values are ignored. Every update is O(1) amortized.
+    - Example:
+      cat metrics.json | lgx streamstats "avg(latency) as avg_latency" "max(latency)" by host -w=100
+    - Rolling error rate over the last 5 minutes:
+      cat access.log | lgx rex '\[(?P<ts>[^\]]+)\] "[^"]*" (?P<status>\d+)' --ts="%d/%b/%Y:%H:%M:%S %z" | lgx eval "is_error = int(int(status) >= 500)" | lgx streamstats "avg(is_error) as error_rate" -w=5m
+
+28. sample [-n=size | -p=rate] [by <fields>] [--seed=seed] [--file=path] [--block=KB]
+    - Outputs a random sample of the input lines, e.g. to explore a new log format before running expensive commands such as cluster or table on everything.
+    - -n keeps a uniform reservoir sample of that many lines, in input order, in memory proportional to the sample size.
+    - -p keeps each line with the given probability (between 0 and 1).
+    - by samples up to -n lines per combination of the given fields (stratified sampling, requires JSON input).
+    - --seed makes the sample reproducible.
+    - With --file=<path> (repeatable) random blocks of the file (default 64 KB) are read instead of the whole file. This is much faster on large files, but lines are sampled in contiguous runs.
+    - With -p, files of fewer than 100 blocks are read completely and sampled line by line.
+    - Example:
+      cat server.log | lgx sample -n=1000 --seed=42
+    - Sample 100 log entries per status code:
+      cat logs.json | lgx sample -n=100 by status | lgx table
+    - Read about 1% of a large file:
+      lgx sample -p=0.01 --file=huge.log | lgx mul "^[0-9]{4}-[0-9]{2}-[0-9]{2}"
+
+29. cache stats | cache clear
+    - Shows the location, number of entries and size of the result cache used by the --cache option, or removes all cached results.
+    - Example:
+      lgx cache stats
+
+30. enrich <field> <command_template> [--as=field] [--threads=N] [--ttl=secs] [--max-keys=N]
+    - Adds the output of a command run for the value of the field to each record, e.g. reverse DNS, geo or ID lookups.
+    - The value is shell quoted and replaces {} in the command template, or is appended to the command when there is
+      no {}.
+    - A JSON object output is merged into the record, any other output is stored in the --as field (default
+      <field>_enriched). With --as the whole output goes to that field.
+    - The command runs once per distinct value: values already being looked up are shared, and results are kept in an
+      LRU cache of --max-keys values (default 100000), expiring after --ttl seconds when given.
+    - Commands run concurrently in --threads threads (default 20) and records are written in the input order.
+    - Records without the field are written unchanged, a failing command stops with an error.
+    - Example:
+      cat access.json | lgx enrich ip 'dig +short -x {}' --as=host
+    - Merge the JSON output of a script:
+      cat logs.json | lgx enrich user_id './user_info.sh {}' --threads=50 --ttl=300
+
+31. write <path> [--format=format] [--batch=rows] [--level=N] [--compression=codec]
+    - Writes the JSON lines to a file for other tools: JSON lines, gzip or zstd compressed JSON lines, Arrow IPC
+      (Feather v2) or Parquet.
+    - The format comes from the file name (.jsonl, .jsonl.gz, .jsonl.zst, .arrow, .feather, .parquet) or from
+      --format=jsonl|jsonl.gz|jsonl.zst|arrow|parquet. A path of - writes to stdout.
+    - Records are written in batches of --batch rows (default 65536), so memory stays bounded whatever the input size.
+    - Arrow and Parquet need the pyarrow package, zstd needs the zstandard package on Python versions before 3.14.
+    - The Arrow and Parquet columns are inferred from the first batch: bool, int, float or string. Columns mixing
+      types, nested values and null only columns are strings, nested values are written as JSON. Fields only seen
+      after the first batch are dropped, bools in int and float columns are written as 1 and 0, and other values
+      that don't fit their column (e.g. "n/a" or 2.5 in an int column) are written as null, all with a warning.
+    - Every input line must be JSON, and a JSON object for Arrow and Parquet. When the command fails, e.g. on an
+      invalid line, the partially written file is removed.
+    - --level sets the gzip (default 6) or zstd (default 3) compression level, --compression the Arrow (lz4, zstd) or
+      Parquet (snappy by default, zstd, gzip, none ...) codec.
+    - Example:
+      cat access.log | lgx rex "(?P<ip>\S+) .* (?P<status>\d{3}) (?P<bytes>\d+)" | lgx write access.parquet
+    - Compress the parsed logs:
+      cat app.json | lgx write app.jsonl.zst --level=9
+    - Stream Arrow IPC to another program:
+      cat app.json | lgx write - --format=arrow | python load.py
+
+Global Options:
+---------------
+These options can be added to any command.
+
+--stats[=seconds]
+    - Reports records in/out, bytes, wall and CPU time split by read/decode/compute/encode/write, and peak memory
+      as a JSON line on stderr when the command exits.
+    - With a number of seconds, a progress line is also reported periodically, e.g. while following a live log.
+    - Buffering commands (sort, table, group, cluster, csv) also report the rows and memory of their record store.
+    - Example:
+      cat server.log | lgx rex "(?P<url>[A-Z]+ \S+)" --stats | lgx group url --stats
+      tail -f server.log | lgx match ERROR --stats=10
+
+--profile[=path]
+    - Runs the command under cProfile and writes the profile to the given path (default lgx-<command>.prof).
+    - Example:
+      cat logs.json | lgx sort -duration --profile=sort.prof && python -m pstats sort.prof
+
+--cache [--cache-size=MB]
+    - Caches the output of the command and replays it when the same command runs again on the same input.
+    - The cache key covers the command and its arguments, the tool version, and the input: the identity and
+      modification time of files redirected to stdin or given as arguments, or a hash of piped input.
+    - Entries are gzip compressed in ~/.cache/lgx (LGX_CACHE_DIR), and the least recently used entries are
+      removed above 1024 MB (--cache-size or LGX_CACHE_SIZE_MB).
+    - Commands whose output depends on other sources, such as lookup commands or sample without a seed, are cached too,
+      so only add --cache where the output is expected to stay the same.
+    - Piped input is read completely before the command starts. When it pauses for 2 seconds (LGX_CACHE_IDLE_SECONDS)
+      after its first data, as with tail -f, it's treated as a live stream: --cache is ignored with a warning
+      and the command runs as usual. On Windows pipes can't be polled, so don't use --cache on live streams.
+    - Example:
+      cat app.log | lgx mul "^[0-9]{4}-" --cache | lgx rex "(?P<level>[A-Z]+)" -i=_line --cache | lgx where "level == 'ERROR'"
+
 Examples:
 ---------
 
@@ -336,7 +648,58 @@ def match_line_with_regex(line, regex):
     return re.search(regex, line, re.DOTALL) is not None
 
 
+def compile_literals(terms):
+    """
+    Compile literal terms into one regex shaped like a trie of the terms, e.g. ["10.0.0.1", "10.0.0.2", "10.1.5.3"]
+    gives 10\.(?:0\.0\.[12]|1\.5\.3). Shared prefixes are matched once, so the work per position grows with the
+    branching of the trie instead of the number of terms. The optional suffixes are greedy, so the longest term
+    matching at a position wins.
+    """
+    trie = {}
+    for term in terms:
+        if term:
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[""] = {}
+    if not trie:
+        raise Exception("No match terms specified")
+    return re.compile(trie_regex(trie))
+
+
+def trie_regex(node):
+    single_chars = []
+    branches = []
+    for char in sorted(key for key in node if key):
+        child = node[char]
+        if len(child) == 1 and "" in child:
+            single_chars.append(re.escape(char))
+            continue
+        # Follow chains of single children as plain literals, which keeps the nesting shallow for long terms
+        literal = [re.escape(char)]
+        while len(child) == 1:
+            char, child = next(iter(child.items()))
+            literal.append(re.escape(char))
+        branches.append("".join(literal) + trie_regex(child))
+    if len(single_chars) == 1:
+        branches.append(single_chars[0])
+    elif single_chars:
+        branches.append("[" + "".join(single_chars) + "]")
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return "(?:" + pattern + ")?" if "" in node else pattern
+
+
+def read_terms_file(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\r\n") for line in f if line.strip()]
+
+
 def input_lines(strip=True):
+    if STATS is not None:
+        yield from _input_lines_with_stats(strip)
+        return
     while True:
         try:
             if strip:
@@ -347,6 +710,18 @@ def input_lines(strip=True):
             return
 
 
+def _input_lines_with_stats(strip):
+    while True:
+        start = time.perf_counter()
+        try:
+            line = input()
+        except EOFError:
+            STATS.read_time += time.perf_counter() - start
+            return
+        STATS.add_input(line, time.perf_counter() - start)
+        yield line.strip() if strip else line
+
+
 def regex_extract(line, regex):
     match = re.search(regex, line, re.DOTALL)
     if match:
@@ -365,7 +740,12 @@ def _write(stream, line, color=None):
         raise InterruptedError
 
 def out_write(line, color=None):
+    if STATS is None:
+        _write(sys.stdout, line, color=color)
+        return
+    start = time.perf_counter()
     _write(sys.stdout, line, color=color)
+    STATS.add_output(line, time.perf_counter() - start)
 
 def err_write(line, color=None):
     _write(sys.stderr, line, color=color)
@@ -506,6 +886,7 @@ def error_handler(operation_name, context_info={}):
 
 
 def json_loads(line, description=None):
+    start = time.perf_counter() if STATS is not None else None
     try:
         return json.loads(line)
     except json.JSONDecodeError as e:
@@ -513,34 +894,1284 @@ def json_loads(line, description=None):
             raise Exception(f"Invalid {description} format, Expected JSON format. | {str(e)}")
         else:
             raise Exception(f"Invalid data format, Expected JSON format. | {str(e)}")
+    finally:
+        if start is not None:
+            STATS.decode_time += time.perf_counter() - start
+
+
+def json_dumps(data):
+    if STATS is None:
+        return json.dumps(data)
+    start = time.perf_counter()
+    try:
+        return json.dumps(data)
+    finally:
+        STATS.encode_time += time.perf_counter() - start
+
+
+def peak_memory_kb():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+class Stats:
+    """
+    Per command throughput counters, filled in by the shared input/output/JSON helpers.
+    Reported as a JSON line on stderr at exit, and every `interval` seconds when an interval is given.
+    """
+
+    def __init__(self, command, interval=0):
+        self.command = command
+        self.interval = interval
+        self.records_in = 0
+        self.bytes_in = 0
+        self.records_out = 0
+        self.bytes_out = 0
+        self.read_time = 0.0
+        self.decode_time = 0.0
+        self.encode_time = 0.0
+        self.write_time = 0.0
+        self.extra = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.last_report = self.start_wall
+
+    def add_input(self, line, elapsed):
+        self.records_in += 1
+        self.bytes_in += len(line) + 1
+        self.read_time += elapsed
+        if self.interval and time.perf_counter() - self.last_report >= self.interval:
+            self.report(final=False)
+
+    def add_output(self, line, elapsed):
+        self.records_out += 1
+        self.bytes_out += len(line) + 1
+        self.write_time += elapsed
+
+    def snapshot(self):
+        wall_time = time.perf_counter() - self.start_wall
+        io_time = self.read_time + self.decode_time + self.encode_time + self.write_time
+        return {
+            "command": self.command,
+            "records_in": self.records_in,
+            "records_out": self.records_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "wall_time": round(wall_time, 4),
+            "cpu_time": round(time.process_time() - self.start_cpu, 4),
+            "read_time": round(self.read_time, 4),
+            "decode_time": round(self.decode_time, 4),
+            "compute_time": round(max(wall_time - io_time, 0), 4),
+            "encode_time": round(self.encode_time, 4),
+            "write_time": round(self.write_time, 4),
+            "records_per_sec": round(self.records_in / wall_time, 1) if wall_time else None,
+            "peak_memory_kb": peak_memory_kb(),
+            **self.extra
+        }
+
+    def report(self, final=True):
+        self.last_report = time.perf_counter()
+        if sys.stderr.closed:
+            return
+        err_write(json.dumps({"stats" if final else "progress": self.snapshot()}))
+
+
+def start_profiler():
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, path):
+    profiler.disable()
+    profiler.dump_stats(path)
+    if not sys.stderr.closed:
+        err_write(f"Profile written to {path}, view it with: python -m pstats {path}")
+
+
+def pop_option(args, *names, default=None):
+    """
+    Remove the first `name=value` option matching any of the given names from args and return its value.
+    """
+    for arg in args:
+        for name in names:
+            if arg.startswith(name + "="):
+                args.remove(arg)
+                return arg.split("=", 1)[1]
+    return default
+
+
+def pop_options(args, *names):
+    """
+    Remove all `name=value` options matching any of the given names from args and return their values.
+    """
+    values = []
+    value = pop_option(args, *names)
+    while value is not None:
+        values.append(value)
+        value = pop_option(args, *names)
+    return values
+
+
+def extract_time(line, time_regex, time_format):
+    match = time_regex.search(line)
+    if not match:
+        return None
+    if "ts" in time_regex.groupindex:
+        value = match.group("ts")
+    elif time_regex.groups:
+        value = match.group(1)
+    else:
+        value = match.group(0)
+    return EXEC_UTIL_FUNCS['strptime'](value, time_format)
+
+
+def time_index_path(path):
+    return path + TIME_INDEX_SUFFIX
+
+
+def load_time_index(path):
+    index_path = time_index_path(path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, encoding="utf-8") as f:
+        index = json_loads(f.read(), description="time index")
+    if index.get("version") != TIME_INDEX_VERSION:
+        return None
+    return index
+
+
+def file_head_digest(path, size):
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(size), digest_size=16).hexdigest()
+
+
+def time_index_stale(path, index):
+    """
+    Return why the indexed offsets no longer match the file, or None if the file is unchanged or only appended to.
+    """
+    file_stat = os.stat(path)
+    if file_stat.st_ino != index["inode"]:
+        return "the file was replaced"
+    if file_stat.st_size < index["file_size"]:
+        return "the file was truncated"
+    if file_stat.st_size == index["file_size"] and file_stat.st_mtime_ns != index["mtime_ns"]:
+        return "the file was rewritten"
+    if file_head_digest(path, index["head_size"]) != index["head"]:
+        return "the start of the file changed"
+    return None
+
+
+def new_time_index(settings):
+    return {"version": TIME_INDEX_VERSION, **settings, "size": 0, "entries": []}
+
+
+def scan_time_index(path, index):
+    """
+    Scan the file from the last indexed position and append (timestamp, offset) entries
+    for event start lines, at most one entry every `every` KB.
+    Only complete lines are indexed, so a partially written last line is picked up on the next run.
+    """
+    time_regex = re.compile(index["time_regex"], re.DOTALL)
+    start_regex = re.compile(index["mul"], re.DOTALL) if index.get("mul") else None
+    every = index["every"] * 1024
+    file_stat = os.stat(path)
+    entries = index["entries"]
+    last_entry_offset = entries[-1][1] if entries else None
+    offset = index["size"]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            if last_entry_offset is None or offset - last_entry_offset >= every:
+                line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+                if start_regex is None or start_regex.search(line):
+                    ts = extract_time(line, time_regex, index["time_format"])
+                    if ts is not None:
+                        entries.append([ts, offset])
+                        last_entry_offset = offset
+            offset += len(raw_line)
+    index["size"] = offset
+    # Identify the indexed file, so offsets aren't reused after it's replaced, truncated or rewritten
+    index["inode"] = file_stat.st_ino
+    index["file_size"] = file_stat.st_size
+    index["mtime_ns"] = file_stat.st_mtime_ns
+    index["head_size"] = min(file_stat.st_size, TIME_INDEX_HEAD_BYTES)
+    index["head"] = file_head_digest(path, index["head_size"])
+    return index
+
+
+def save_time_index(path, index):
+    with open(time_index_path(path), "w", encoding="utf-8") as f:
+        f.write(json.dumps(index))
+
+
+def parse_time_bound(value, time_format):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return EXEC_UTIL_FUNCS['strptime'](value, time_format)
+
+
+def term_index_path(path):
+    return path + TERM_INDEX_SUFFIX
+
+
+def build_term_index(path, block_size_kb=DEFAULT_TERM_BLOCK_KB):
+    """
+    Split the file into line aligned blocks of about `block_size_kb` KB and map every lower-cased
+    word token to the sorted list of blocks it appears in. Posting lists are delta encoded and the
+    whole index is zlib compressed.
+    """
+    block_size = block_size_kb * 1024
+    block_offsets = []
+    postings = defaultdict(list)
+    offset = 0
+    block_start = None
+    with open(path, "rb") as f:
+        for raw_line in f:
+            if block_start is None or offset - block_start >= block_size:
+                block_start = offset
+                block_offsets.append(offset)
+            block_id = len(block_offsets) - 1
+            for token in TOKEN_REGEX.findall(raw_line.decode("utf-8", errors="replace").lower()):
+                blocks = postings[token]
+                if not blocks or blocks[-1] != block_id:
+                    blocks.append(block_id)
+            offset += len(raw_line)
+    stat = os.stat(path)
+    index = {
+        "version": TERM_INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "blocks": block_offsets,
+        "postings": {token: [b - a for a, b in zip([0] + blocks, blocks)] for token, blocks in postings.items()}
+    }
+    with open(term_index_path(path), "wb") as f:
+        f.write(zlib.compress(json.dumps(index).encode("utf-8")))
+    return index
+
+
+def load_term_index(path):
+    """
+    Load the term index of a file, or None if it doesn't exist or is stale.
+    """
+    index_path = term_index_path(path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "rb") as f:
+        index = json_loads(zlib.decompress(f.read()).decode("utf-8"), description="term index")
+    stat = os.stat(path)
+    if index.get("version") != TERM_INDEX_VERSION or index["size"] != stat.st_size or index["mtime"] != stat.st_mtime:
+        return None
+    return index
+
+
+def token_constraints(literal, word_bounded=True):
+    """
+    Turn a required literal into (token, kind) constraints on indexed tokens, where kind is
+    "exact", "prefix", "suffix" or "substring" depending on whether the literal itself shows
+    where the token starts and ends.
+    """
+    constraints = []
+    literal = literal.lower()
+    for run in TOKEN_REGEX.finditer(literal):
+        starts = word_bounded and run.start() > 0
+        ends = word_bounded and run.end() < len(literal)
+        kind = "exact" if starts and ends else "prefix" if starts else "suffix" if ends else "substring"
+        constraints.append((run.group(0), kind))
+    return constraints
+
+
+def regex_required_literals(regex):
+    """
+    Return literal strings that every match of the regex must contain, or an empty list
+    when the regex can't be decomposed (alternations, character classes, optional parts ...).
+    """
+    literals = []
+
+    def walk(parsed):
+        current = []
+        for op, av in parsed:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+                continue
+            if current:
+                literals.append("".join(current))
+                current = []
+            if op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                walk(av[2])
+        if current:
+            literals.append("".join(current))
+
+    try:
+        walk(sre_parse.parse(regex, re.DOTALL))
+    except Exception:
+        return []
+    return literals
+
+
+def expr_required_literals(expr):
+    """
+    Return the literals of `'text' in _line` checks that must all hold for the where expression to be true.
+    """
+    try:
+        node = ast.parse(expr, mode="eval").body
+    except SyntaxError:
+        return []
+    conditions = node.values if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) else [node]
+    literals = []
+    for condition in conditions:
+        if isinstance(condition, ast.Compare) and len(condition.ops) == 1 and isinstance(condition.ops[0], ast.In) \
+                and isinstance(condition.left, ast.Constant) and isinstance(condition.left.value, str) \
+                and isinstance(condition.comparators[0], ast.Name) and condition.comparators[0].id == LINE_KEY:
+            literals.append(condition.left.value)
+    return literals
+
+
+def token_constraints_for_literals(literals, word_bounded=True):
+    return [c for literal in literals for c in token_constraints(literal, word_bounded)]
+
+
+def candidate_blocks(index, constraints):
+    candidates = None
+    for token, kind in constraints:
+        if kind == "exact":
+            matches = [token] if token in index["postings"] else []
+        else:
+            check = {"prefix": str.startswith, "suffix": str.endswith, "substring": str.__contains__}[kind]
+            matches = [t for t in index["postings"] if check(t, token)]
+        blocks = set()
+        for t in matches:
+            block_id = 0
+            for delta in index["postings"][t]:
+                block_id += delta
+                blocks.add(block_id)
+        candidates = blocks if candidates is None else candidates & blocks
+        if not candidates:
+            break
+    return sorted(candidates) if candidates is not None else None
+
+
+def file_lines(paths, constraints=None, strip=True):
+    """
+    Yield the lines of the given files. When a file has an up to date term index and constraints are given,
+    only the blocks that may contain all constrained tokens are read; otherwise the whole file is scanned.
+    """
+    for path in paths:
+        index = load_term_index(path) if constraints else None
+        blocks = candidate_blocks(index, constraints) if index is not None else None
+        with open(path, "rb") as f:
+            if blocks is None:
+                # Full scan, streamed line by line so that memory doesn't grow with the file size
+                for raw_line in f:
+                    line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+                    if STATS is not None:
+                        STATS.add_input(line, 0)
+                    yield line.strip() if strip else line.rstrip("\r")
+                continue
+            offsets = index["blocks"] + [index["size"]]
+            for block in blocks:
+                start, end = offsets[block], offsets[block + 1]
+                read_start = time.perf_counter()
+                f.seek(start)
+                data = f.read(end - start)
+                if STATS is not None:
+                    STATS.read_time += time.perf_counter() - read_start
+                lines = data.decode("utf-8", errors="replace").split("\n")
+                if lines[-1] == "":
+                    lines.pop()
+                for line in lines:
+                    if STATS is not None:
+                        STATS.add_input(line, 0)
+                    yield line.strip() if strip else line.rstrip("\r")
+
+
+def sketch_value(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter using 2^precision one byte registers
+    (precision 14 -> 16 KB, ~0.8% standard error). Sketches with the same precision can be merged.
+    """
+
+    def __init__(self, precision=DEFAULT_HLL_PRECISION, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        h = hash64(sketch_value(value))
+        index = h >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precisions")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_json(self):
+        return {"precision": self.precision, HLL_KEY: base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @staticmethod
+    def from_json(data):
+        return HyperLogLog(data["precision"], base64.b64decode(data[HLL_KEY]))
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitter sketch keeping at most `capacity` counters.
+    Every reported count overestimates the true count by at most its error.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+
+    def _min_item(self):
+        # The heap holds (count, item) snapshots, skip the ones that are outdated
+        while True:
+            count, item = self.heap[0]
+            if self.counts.get(item) == count:
+                return item
+            heapq.heappop(self.heap)
+
+    def add(self, item, weight=1):
+        """
+        Count the item `weight` times, returns the item evicted to make room for it, if any.
+        """
+        counts = self.counts
+        evicted = None
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0
+        else:
+            evicted = self._min_item()
+            min_count = counts.pop(evicted)
+            del self.errors[evicted]
+            counts[item] = min_count + weight
+            self.errors[item] = min_count
+        heapq.heappush(self.heap, (counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, i) for i, count in counts.items()]
+            heapq.heapify(self.heap)
+        return evicted
+
+    def top(self, limit):
+        items = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch with `depth` rows of `width` counters. Estimates never undercount.
+    """
+
+    def __init__(self, width=2 ** 16, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, item):
+        h = hash64(sketch_value(item))
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item):
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(item)):
+            row[index] += 1
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, item):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(item)))
+
+
+class RareItems:
+    """
+    Approximate least frequent items: counts are kept in a Count-Min sketch and only the `capacity`
+    items with the lowest estimated counts are kept as candidates.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.sketch = CountMinSketch()
+        self.candidates = set()
+
+    def add(self, item):
+        self.sketch.add(item)
+        self.candidates.add(item)
+        if len(self.candidates) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        estimates = sorted(self.candidates, key=self.sketch.estimate)
+        self.candidates = set(estimates[:self.capacity])
+
+    def rare(self, limit):
+        items = sorted(((item, self.sketch.estimate(item)) for item in self.candidates), key=lambda kv: kv[1])
+        return [(item, count, None) for item, count in items[:limit]]
+
+
+def to_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def parse_window(window):
+    """
+    Parse a window size into (record count, duration in ms): "100" is a count window, "5m" a time window.
+    """
+    if window is None:
+        return None, None
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m|h|d)?", window.strip())
+    if not match:
+        raise Exception(f"Invalid window: {window}, expected a record count (e.g. 100) or a duration (e.g. 30s, 5m, 1h)")
+    if match.group(2) is None:
+        return int(float(match.group(1))), None
+    return None, float(match.group(1)) * DURATION_UNITS_MS[match.group(2)]
+
+
+def parse_stream_aggregates(tokens):
+    """
+    Parse `agg(field) [as name] ... [by field ...]` tokens into ([(agg, field, name)], by_fields).
+    """
+    words = [w for token in tokens for w in token.split()]
+    aggregates = []
+    by_fields = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if word == "by":
+            by_fields = words[i + 1:]
+            break
+        if word == "as" and aggregates and i + 1 < len(words):
+            agg, field, _ = aggregates[-1]
+            aggregates[-1] = (agg, field, words[i + 1])
+            i += 2
+            continue
+        match = re.fullmatch(r"(\w+)\((\w*)\)", word)
+        if not match or match.group(1) not in STREAM_AGGREGATES:
+            raise Exception(f"Invalid aggregate: {word}, expected one of {', '.join(a + '(field)' for a in STREAM_AGGREGATES)}")
+        agg, field = match.group(1), match.group(2) or None
+        if field is None and agg not in ("count", "rate"):
+            raise Exception(f"Aggregate {agg} requires a field")
+        aggregates.append((agg, field, word))
+        i += 1
+    if not aggregates:
+        raise Exception("No aggregates specified")
+    return aggregates, by_fields
+
+
+class RollingWindow:
+    """
+    Sliding window over the numeric values of one field in one partition.
+    Sum and count are maintained incrementally, min and max with monotonic deques,
+    so every update is O(1) amortized. Without a window size nothing is ever evicted.
+    """
+
+    def __init__(self, bounded):
+        self.bounded = bounded
+        self.entries = deque()
+        self.min_entries = deque()
+        self.max_entries = deque()
+        self.sum = 0
+        self.count = 0
+        self.first = None
+        self.last = None
+
+    def push(self, seq, ts, value):
+        entry = (seq, ts, value)
+        self.sum += value
+        self.count += 1
+        self.last = entry
+        if not self.bounded:
+            if self.first is None:
+                self.first = entry
+            if not self.min_entries or value < self.min_entries[0][2]:
+                self.min_entries = deque([entry])
+            if not self.max_entries or value > self.max_entries[0][2]:
+                self.max_entries = deque([entry])
+            return
+        self.entries.append(entry)
+        while self.min_entries and self.min_entries[-1][2] >= value:
+            self.min_entries.pop()
+        self.min_entries.append(entry)
+        while self.max_entries and self.max_entries[-1][2] <= value:
+            self.max_entries.pop()
+        self.max_entries.append(entry)
+
+    def evict(self, min_seq, min_ts):
+        entries = self.entries
+        while entries and (entries[0][0] < min_seq or (min_ts is not None and entries[0][1] <= min_ts)):
+            seq, _, value = entries.popleft()
+            self.sum -= value
+            self.count -= 1
+            if self.min_entries and self.min_entries[0][0] == seq:
+                self.min_entries.popleft()
+            if self.max_entries and self.max_entries[0][0] == seq:
+                self.max_entries.popleft()
+        if self.bounded:
+            self.first = entries[0] if entries else None
+            if not entries:
+                self.last = None
+
+    def value(self, agg, window_ms):
+        if agg == "count":
+            return self.count
+        if self.count == 0:
+            return None
+        if agg == "sum":
+            return self.sum
+        if agg == "avg":
+            return self.sum / self.count
+        if agg == "min":
+            return self.min_entries[0][2]
+        if agg == "max":
+            return self.max_entries[0][2]
+        if agg == "rate":
+            # Increase per second over the window, or per record without a time field
+            (first_seq, first_ts, first_value), (last_seq, last_ts, last_value) = self.first, self.last
+            if first_ts is not None and last_ts is not None:
+                span = (last_ts - first_ts) / 1000
+            else:
+                span = last_seq - first_seq
+            return (last_value - first_value) / span if span else None
+        return None
+
+
+class StreamPartition:
+
+    def __init__(self, fields, bounded):
+        self.seq = 0
+        self.records = RollingWindow(bounded)
+        self.windows = {f: RollingWindow(bounded) for f in fields}
+        self.previous = {}
+
+
+class Reservoir:
+    """
+    Uniform reservoir sample of `size` items using Algorithm L: after the reservoir is full, the number of
+    items to skip is drawn directly, so the cost is O(size * (1 + log(n / size))) random draws for n items.
+    Items are returned in input order.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self.next_index = None
+        self.w = None
+
+    def _random_log(self):
+        return math.log(1 - self.rng.random())
+
+    def _advance(self):
+        self.next_index += int(self._random_log() / math.log(1 - self.w)) + 1 if self.w < 1 else 1
+
+    def add(self, item):
+        index = self.seen
+        self.seen += 1
+        if index < self.size:
+            self.items.append((index, item))
+            if index == self.size - 1:
+                self.w = math.exp(self._random_log() / self.size)
+                self.next_index = index
+                self._advance()
+        elif index == self.next_index:
+            self.items[self.rng.randrange(self.size)] = (index, item)
+            self.w *= math.exp(self._random_log() / self.size)
+            self._advance()
+
+    def sample(self):
+        return [item for _, item in sorted(self.items, key=lambda i: i[0])]
+
+
+def bernoulli_skips(probability, rng):
+    """
+    Yield the gaps between Bernoulli(probability) selected items, drawn from a geometric distribution
+    so that only one random number is needed per selected item.
+    """
+    if probability >= 1:
+        while True:
+            yield 0
+    log_q = math.log(1 - probability)
+    while True:
+        yield int(math.log(1 - rng.random()) / log_q)
+
+
+def file_block_lines(path, offset, end):
+    """
+    Yield the complete lines starting inside [offset, end) of a file, skipping the partial line at the block start.
+    """
+    with open(path, "rb") as f:
+        if offset > 0:
+            f.seek(offset - 1)
+            # Skip to the next line start, unless the block starts exactly at one
+            if f.read(1) != b"\n":
+                f.readline()
+        while f.tell() < end:
+            raw_line = f.readline()
+            if not raw_line:
+                return
+            yield raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+class Column:
+    """
+    One field of a RecordStore. Integer and float fields are kept in typed arrays (8 bytes per value);
+    any other value type turns the column into a plain list, where repeated strings share one object.
+    Rows that don't have the field hold a placeholder, the row schema tells whether the field is present.
+    """
+    __slots__ = ("kind", "values", "interned")
+
+    def __init__(self):
+        self.kind = None
+        self.values = None
+        self.interned = None
+
+    def _to_objects(self):
+        self.kind = "object"
+        self.values = list(self.values)
+        self.interned = {}
+
+    def set(self, row, value):
+        kind = self.kind
+        value_type = type(value)
+        if kind == "object":
+            pass
+        elif kind == "int":
+            if value_type is not int or not -2 ** 63 <= value < 2 ** 63:
+                self._to_objects()
+        elif kind == "float":
+            if value_type is not float:
+                self._to_objects()
+        elif value_type is int and -2 ** 63 <= value < 2 ** 63:
+            self.kind, self.values = "int", array("q")
+        elif value_type is float:
+            self.kind, self.values = "float", array("d")
+        else:
+            self.kind, self.values, self.interned = "object", [], {}
+
+        values = self.values
+        if len(values) < row:
+            values.extend([None if self.kind == "object" else 0] * (row - len(values)))
+        if value_type is str and len(self.interned) < MAX_INTERNED_VALUES_PER_COLUMN:
+            value = self.interned.setdefault(value, value)
+        values.append(value)
+
+    def memory_bytes(self):
+        if self.kind == "object":
+            seen = set()
+            size = sys.getsizeof(self.values)
+            for value in self.values:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+            return size
+        return self.values.buffer_info()[1] * self.values.itemsize if self.values is not None else 0
+
+
+class RecordStore:
+    """
+    Columnar storage for the records buffered by commands such as sort, table, group and cluster.
+    Field names are stored once per distinct key order (schema) instead of once per record,
+    and rows are only materialized into dicts when they are emitted.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.schemas = []
+        self.schema_fields = []
+        self.schema_ids = {}
+        self.row_schemas = array("I")
+
+    def __len__(self):
+        return len(self.row_schemas)
+
+    def append(self, record):
+        row = len(self.row_schemas)
+        keys = tuple(record)
+        schema_id = self.schema_ids.get(keys)
+        if schema_id is None:
+            keys = tuple(sys.intern(k) for k in keys)
+            schema_id = self.schema_ids[keys] = len(self.schemas)
+            self.schemas.append(keys)
+            self.schema_fields.append(frozenset(keys))
+        self.row_schemas.append(schema_id)
+        columns = self.columns
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = Column()
+            column.set(row, value)
+        return row
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        return self
+
+    def keys(self, row):
+        return list(self.schemas[self.row_schemas[row]])
+
+    def all_keys(self):
+        return list(self.columns.keys())
+
+    def get(self, row, key, default=None):
+        if key not in self.schema_fields[self.row_schemas[row]]:
+            return default
+        return self.columns[key].values[row]
+
+    def row(self, row):
+        columns = self.columns
+        return {key: columns[key].values[row] for key in self.schemas[self.row_schemas[row]]}
+
+    def rows(self, row_ids=None):
+        for row in (range(len(self)) if row_ids is None else row_ids):
+            yield self.row(row)
+
+    def memory_bytes(self):
+        return sum(c.memory_bytes() for c in self.columns.values()) \
+            + self.row_schemas.buffer_info()[1] * self.row_schemas.itemsize
+
+
+def report_store(store):
+    if STATS is not None:
+        STATS.extra["record_store_rows"] = STATS.extra.get("record_store_rows", 0) + len(store)
+        STATS.extra["record_store_kb"] = STATS.extra.get("record_store_kb", 0) + store.memory_bytes() // 1024
+
+
+class TimestampParser:
+    """
+    strptime replacement compiled once per format: the format is turned into a regex, and the epoch
+    value of each distinct date/time up to the second is memoized, so consecutive log lines within the
+    same second only cost a regex match. Formats with directives the regex can't express fall back
+    to datetime.strptime.
+    Month and day names are matched in English, as in the C locale.
+    """
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.regex = self._compile(fmt)
+        self.has_fraction = self.regex is not None and "f" in self.regex.groupindex
+        self.cache = {}
+        self.timezones = {}
+        self.last_key = None
+        self.last_seconds = None
+
+    @staticmethod
+    def _compile(fmt):
+        pattern = []
+        used = set()
+        i = 0
+        while i < len(fmt):
+            char = fmt[i]
+            if char == "%" and i + 1 < len(fmt):
+                directive = fmt[i + 1]
+                if directive not in TIMESTAMP_DIRECTIVES or directive in used:
+                    return None
+                if directive not in "aA%":
+                    used.add(directive)
+                pattern.append(TIMESTAMP_DIRECTIVES[directive])
+                i += 2
+                continue
+            # Like strptime, whitespace in the format matches any amount of whitespace
+            pattern.append(r"\s+" if char.isspace() else re.escape(char))
+            i += 1
+        return re.compile("".join(pattern), re.IGNORECASE)
+
+    def _timezone(self, value):
+        tz = self.timezones.get(value)
+        if tz is None:
+            if value.lower() == "z":
+                tz = timezone.utc
+            else:
+                digits = value[1:].replace(":", "")
+                offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+                tz = timezone(-offset if value[0] == "-" else offset)
+            self.timezones[value] = tz
+        return tz
+
+    def _seconds(self, fields):
+        if "Y" in fields:
+            year = int(fields["Y"])
+        elif "y" in fields:
+            year = int(fields["y"])
+            year += 2000 if year < 69 else 1900
+        else:
+            year = 1900
+        if "m" in fields:
+            month = int(fields["m"])
+        elif "b" in fields or "B" in fields:
+            name = (fields.get("b") or fields.get("B")).lower()
+            names = MONTH_NAMES if "b" in fields else FULL_MONTH_NAMES
+            if name not in names:
+                raise ValueError(f"time data has an invalid month name: {name}")
+            month = names.index(name) + 1
+        else:
+            month = 1
+        if "I" in fields:
+            hour = int(fields["I"]) % 12
+            if fields.get("p", "").lower() == "pm":
+                hour += 12
+        else:
+            hour = int(fields.get("H", 0))
+        tz = self._timezone(fields["z"]) if "z" in fields else None
+        return datetime(year, month, int(fields.get("d", 1)), hour, int(fields.get("M", 0)),
+                        int(fields.get("S", 0)), tzinfo=tz).timestamp()
+
+    def parse(self, date_str):
+        """
+        Return the epoch milliseconds of the date string, like datetime.strptime(date_str, fmt).timestamp() * 1000.
+        """
+        if self.regex is None:
+            return datetime.strptime(date_str, self.fmt).timestamp() * 1000
+        if not self.has_fraction:
+            # The string itself identifies the second, a cache hit skips even the regex match
+            if date_str == self.last_key:
+                return self.last_seconds * 1000
+            seconds = self.cache.get(date_str)
+            if seconds is None:
+                seconds = self._parse_seconds(date_str, date_str)[0]
+            self.last_key, self.last_seconds = date_str, seconds
+            return seconds * 1000
+
+        seconds, fraction = self._parse_seconds(date_str, None)
+        return seconds * 1000 + int(fraction.ljust(6, "0")) / 1000
+
+    def _parse_seconds(self, date_str, key):
+        match = self.regex.fullmatch(date_str)
+        if match is None:
+            raise ValueError(f"time data {date_str!r} does not match format {self.fmt!r}")
+        fraction = None
+        if key is None:
+            # Key on the string without its fractional part
+            fraction = match.group("f")
+            key = date_str[:match.start("f")] + date_str[match.end("f"):]
+            seconds = self.last_seconds if key == self.last_key else self.cache.get(key)
+            if seconds is not None:
+                self.last_key, self.last_seconds = key, seconds
+                return seconds, fraction
+        if len(self.cache) >= MAX_TIMESTAMP_CACHE_SIZE:
+            self.cache.clear()
+        fields = {k: v for k, v in match.groupdict().items() if v is not None}
+        fields.pop("f", None)
+        seconds = self.cache[key] = self._seconds(fields)
+        self.last_key, self.last_seconds = key, seconds
+        return seconds, fraction
+
+
+TIMESTAMP_PARSERS = {}
+TIMESTAMP_FORMAT_CACHE = {}
+
+
+def parse_timestamp(date_str, fmt="%Y-%m-%d %H:%M:%S"):
+    parser = TIMESTAMP_PARSERS.get(fmt)
+    if parser is None:
+        parser = TIMESTAMP_PARSERS[fmt] = TimestampParser(fmt)
+    return parser.parse(date_str)
+
+
+def format_timestamp(ms, fmt="%Y-%m-%d %H:%M:%S"):
+    if "%f" in fmt:
+        return datetime.fromtimestamp(ms / 1000).strftime(fmt)
+    # Without sub-second directives the result only changes once per second, reuse it while it's the same second
+    seconds = math.floor(ms / 1000)
+    cached = TIMESTAMP_FORMAT_CACHE.get(fmt)
+    if cached is not None and cached[0] == seconds:
+        return cached[1]
+    formatted = datetime.fromtimestamp(seconds).strftime(fmt)
+    TIMESTAMP_FORMAT_CACHE[fmt] = (seconds, formatted)
+    return formatted
+
+
+class CacheWriter:
+    """
+    Stand-in for sys.stdout that passes everything through and also writes it to a compressed cache file.
+    """
+
+    def __init__(self, stream, path):
+        self.stream = stream
+        self.path = path
+        self.temp_path = path + f".{os.getpid()}.tmp"
+        self.file = gzip.open(self.temp_path, "wt", encoding="utf-8", compresslevel=1)
+        self.broken = False
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def write(self, text):
+        try:
+            self.stream.write(text)
+        except OSError:
+            self.broken = True
+            raise
+        self.file.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def reconfigure(self, **kwargs):
+        self.stream.reconfigure(**kwargs)
+
+    def commit(self):
+        self.file.close()
+        # error_handler closes stderr when the command is interrupted, the output is incomplete then
+        if self.broken or sys.stderr.closed:
+            self.discard()
+        else:
+            os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class PrefixedInput(io.RawIOBase):
+    """
+    Raw input stream serving some already read bytes, then the rest of a file descriptor.
+    """
+
+    def __init__(self, prefix, fd):
+        self.prefix = prefix
+        self.fd = fd
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = os.read(self.fd, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class ResultCache:
+    """
+    Content addressed cache of command outputs. The key covers the command and its arguments, the tool version
+    (a hash of this script), whether stdout is a terminal, and the input: the identity and mtime of a file
+    redirected to stdin or passed as an argument, or otherwise a hash of the piped input, which is spooled to a
+    temporary file while hashing. Entries are gzip compressed and evicted least recently used first.
+    """
+
+    def __init__(self, directory=CACHE_DIR, size_limit_mb=DEFAULT_CACHE_SIZE_MB):
+        self.directory = directory
+        self.size_limit = size_limit_mb * 1024 * 1024
+        self.spool_path = None
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(CACHE_SUFFIX)]
+
+    def key(self, args, read_stdin=True):
+        digest = hashlib.blake2b(digest_size=20)
+        with open(__file__, "rb") as f:
+            digest.update(hashlib.blake2b(f.read(), digest_size=20).digest())
+        digest.update(json.dumps([args, sys.stdout.isatty()]).encode("utf-8"))
+        for arg in args[1:]:
+            path = arg.split("=", 1)[-1]
+            if os.path.isfile(path):
+                file_stat = os.stat(path)
+                digest.update(json.dumps([os.path.abspath(path), file_stat.st_size, file_stat.st_mtime_ns]).encode())
+        if read_stdin and not sys.stdin.isatty():
+            stdin_stat = os.fstat(sys.stdin.fileno())
+            if stat.S_ISREG(stdin_stat.st_mode):
+                digest.update(json.dumps(["stdin", stdin_stat.st_dev, stdin_stat.st_ino, stdin_stat.st_size,
+                                          stdin_stat.st_mtime_ns]).encode())
+            else:
+                spool_digest = self._spool_stdin()
+                if spool_digest is None:
+                    return None
+                digest.update(spool_digest)
+        return digest.hexdigest()
+
+    def _spool_stdin(self):
+        """
+        Copy the piped input to a spool file while hashing it, and make the command read the copy.
+        Returns None when the input turns out to be a live stream: the command then reads what was spooled
+        followed by the rest of stdin, without caching.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.blake2b(digest_size=20)
+        fd, self.spool_path = tempfile.mkstemp(dir=self.directory, suffix=".spool")
+        atexit.register(self.remove_spool)
+        stdin_fd = sys.stdin.fileno()
+        # Pipes can be polled on Unix only, elsewhere the whole input is read before the command starts
+        poll = select is not None and os.name == "posix"
+        received = False
+        live = False
+        with os.fdopen(fd, "wb") as spool:
+            while True:
+                if poll and received and not select.select([stdin_fd], [], [], CACHE_IDLE_SECONDS)[0]:
+                    live = True
+                    break
+                chunk = os.read(stdin_fd, 1024 * 1024)
+                if not chunk:
+                    break
+                received = True
+                digest.update(chunk)
+                spool.write(chunk)
+        if live:
+            with open(self.spool_path, "rb") as spool:
+                spooled = spool.read()
+            sys.stdin = io.TextIOWrapper(io.BufferedReader(PrefixedInput(spooled, stdin_fd)),
+                                         encoding=sys.stdin.encoding, errors=sys.stdin.errors)
+            return None
+        # The command reads the spooled copy of the input instead of the consumed stdin
+        sys.stdin = open(self.spool_path, encoding=sys.stdin.encoding, errors=sys.stdin.errors)
+        return digest.digest()
+
+    def remove_spool(self):
+        if self.spool_path and os.path.exists(self.spool_path):
+            sys.stdin.close()
+            os.remove(self.spool_path)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def replay(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        os.utime(path)
+        sys.stdout.flush()
+        with gzip.open(path, "rb") as f:
+            try:
+                shutil.copyfileobj(f, sys.stdout.buffer, 1024 * 1024)
+                sys.stdout.buffer.flush()
+            except OSError:
+                pass
+        return True
+
+    def writer(self, key):
+        os.makedirs(self.directory, exist_ok=True)
+        return CacheWriter(sys.stdout, self.path(key))
+
+    def evict(self):
+        entries = sorted(((os.stat(p).st_mtime, os.path.getsize(p), p) for p in self.entries()), reverse=True)
+        total = 0
+        for _, size, path in entries:
+            total += size
+            if total > self.size_limit:
+                os.remove(path)
+
+    def stats(self):
+        entries = [(os.stat(p).st_mtime, os.path.getsize(p)) for p in self.entries()]
+        return {
+            "dir": self.directory,
+            "entries": len(entries),
+            "size_bytes": sum(size for _, size in entries),
+            "limit_bytes": self.size_limit,
+            "oldest": datetime.fromtimestamp(min(entries)[0]).isoformat(timespec="seconds") if entries else None,
+            "newest": datetime.fromtimestamp(max(entries)[0]).isoformat(timespec="seconds") if entries else None
+        }
+
+    def clear(self):
+        entries = self.entries()
+        for path in entries:
+            os.remove(path)
+        return len(entries)
 
 
 # endregion
 
 # region : cmd
-def cmd_rex(regex, input_field=None):
+def cmd_rex(regex, input_field=None, ts_format=None):
+    if ts_format is not None and DEFAULT_TIME_FIELD not in re.compile(regex).groupindex:
+        err_write(f"--ts requires a (?P<{DEFAULT_TIME_FIELD}>...) group in the regex", Colors.FG_RED)
+        exit(1)
     for line in input_lines():
         with error_handler("rex", {"Regex": regex, "Line": line}):
             if input_field is not None:
                 data = json_loads(line)
                 extracted_fields = regex_extract(data[input_field] if input_field in data else '', regex)
-                data.update(extracted_fields)
-                out_write(json.dumps(data))
             else:
                 extracted_fields = regex_extract(line, regex)
+            if ts_format is not None and extracted_fields.get(DEFAULT_TIME_FIELD) is not None:
+                extracted_fields[DEFAULT_TIME_FIELD] = parse_timestamp(extracted_fields[DEFAULT_TIME_FIELD], ts_format)
+            if input_field is not None:
+                data.update(extracted_fields)
+                out_write(json_dumps(data))
+            else:
                 extracted_fields[LINE_KEY] = line
-                out_write(json.dumps(extracted_fields))
+                out_write(json_dumps(extracted_fields))
 
 
-def cmd_match(regex):
-    for line in input_lines():
+def cmd_match(regex, paths=None):
+    lines = file_lines(paths, token_constraints_for_literals(regex_required_literals(regex))) \
+        if paths else input_lines()
+    for line in lines:
         with error_handler("match", {"Regex": regex, "Line": line}):
             if match_line_with_regex(line, regex):
                 out_write(line)
 
 
-def cmd_where(expr):
-    for line in input_lines():
+def cmd_match_any(terms, paths=None):
+    with error_handler("match", {"Terms": len(terms)}):
+        pattern = compile_literals(terms)
+    search = pattern.search
+    # Any one of the terms is enough for a match, so the term index (all tokens required) can't narrow the blocks
+    for line in file_lines(paths) if paths else input_lines():
+        with error_handler("match", {"Terms": len(terms), "Line": line}):
+            if search(line):
+                out_write(line)
+
+
+def cmd_where(expr, paths=None):
+    # Lines are JSON encoded, so escapes may glue extra word characters to the literals: only substring checks are safe.
+    # Literals that JSON escapes (non-ASCII, quotes ...) may be stored either way, they can't narrow the blocks.
+    literals = [literal for literal in expr_required_literals(expr) if json.dumps(literal)[1:-1] == literal]
+    lines = file_lines(paths, token_constraints_for_literals(literals, word_bounded=False)) if paths else input_lines()
+    for line in lines:
         with error_handler("where", {"Expression": expr, "Line": line}):
             if safe_eval(expr, json_loads(line)):
                 out_write(line)
@@ -551,11 +2182,12 @@ def cmd_eval(expr):
         with error_handler("eval", {"Expression": expr, "Line": line}):
             data = json_loads(line)
             safe_exec(expr, data)
-            out_write(json.dumps(data))
+            out_write(json_dumps(data))
 
 
 def cmd_sort(sort_option_exprs, limit=None):
-    lines = [NullSafeDict(json_loads(line)) for line in input_lines()]
+    store = RecordStore().extend(json_loads(line) for line in input_lines())
+    report_store(store)
     sort_options = []
     with error_handler("sort", {"Options": " ".join(sort_option_exprs)}):
         for expr in sort_option_exprs:
@@ -570,27 +2202,28 @@ def cmd_sort(sort_option_exprs, limit=None):
                 reverse = False
             sort_options.append((expr, reverse))
 
-        def sort_key(line_data):
+        def sort_key(row):
             key = []
             for sort_option in sort_options:
                 field_name, reverse = sort_option
+                value = store.get(row, field_name)
                 if reverse:
-                    if isinstance(line_data.get(field_name), (int, float)):
-                        key.append(-line_data.get(field_name))
+                    if isinstance(value, (int, float)):
+                        key.append(-value)
                     else:
                         raise Exception("negative sort key for non-numeric value not supported: " + field_name + "")
                 else:
-                    key.append(line_data.get(field_name))
+                    key.append(value)
             return tuple(key)
 
-        lines.sort(key=sort_key)
+        rows = sorted(range(len(store)), key=sort_key)
 
         count = 0
-        for line in lines:
+        for row in rows:
             count += 1
             if limit is not None and count > limit:
                 break
-            out_write(json.dumps(line))
+            out_write(json_dumps(store.row(row)))
 
 
 def cmd_group_eval(expr):
@@ -598,7 +2231,7 @@ def cmd_group_eval(expr):
         with error_handler("geval", {"Expression": expr, "Line": line}):
             data = json_loads(line)
             safe_exec(expr, data, True)
-            out_write(json.dumps(data))
+            out_write(json_dumps(data))
 
 
 def cmd_reverse():
@@ -617,75 +2250,321 @@ def cmd_help():
 
 def cmd_table(fields=[]):
     with error_handler("table", {"Fields": " ".join(fields)}):
-        data = [NullSafeDict(json_loads(line)) for line in input_lines()]
-        if not data:
+        data = RecordStore().extend(json_loads(line) for line in input_lines())
+        report_store(data)
+        if not len(data):
             return
 
-        # If fields are specified, use them as headers and filter data
-        if fields and len(fields) > 0:
-            headers = fields
-            # Filter out unwanted fields from each row
-            for d in data:
-                keys_to_remove = [k for k in d.keys() if k not in fields]
-                for k in keys_to_remove:
-                    del d[k]
-        else:
-            # If no fields specified, use all keys from first row as headers
-            headers = list(data[0].keys())
+        # If fields are specified, use them as headers, otherwise use all keys from first row as headers
+        headers = list(fields) if fields and len(fields) > 0 else data.keys(0)
 
         # Calculate column widths based on data and headers
         col_widths = []
         for header in headers:
             # Get max width of header and all values in this column
             width = len(str(header))
-            for row in data:
-                cell_value = str(row.get(header, ''))
+            for i in range(len(data)):
+                cell_value = str(data.get(i, header, ''))
                 width = max(width, len(cell_value))
             col_widths.append(width)
 
-        headers.insert(0, "#")
         col_widths.insert(0,  len(str(len(data)))+1)
 
         # Write header row
-        header_row = " | ".join(header.ljust(width) for header, width in zip(headers, col_widths))
+        header_row = " | ".join(header.ljust(width) for header, width in zip(["#", *headers], col_widths))
         out_write(header_row, color=Colors.FG_GREEN)
         out_write("-" * len(header_row))
 
         # Write data rows
         for i in range(len(data)):
-            row = data[i]
-            row['#'] = i+1
-            row_str = " | ".join(str(row.get(key, '')).ljust(width) for key, width in zip(headers, col_widths))
+            cells = [str(i+1), *(str(data.get(i, key, '')) for key in headers)]
+            row_str = " | ".join(cell.ljust(width) for cell, width in zip(cells, col_widths))
             out_write(row_str, color=Colors.FG_MAGENTA if i%2 == 0 else Colors.FG_WHITE)
 
 
-def cmd_json():
-    with error_handler("json", {}):
-        out_write(json.dumps([json_loads(line) for line in input_lines()]))
+def cmd_json(stream=False):
+    if not stream:
+        with error_handler("json", {}):
+            out_write(json_dumps([json_loads(line) for line in input_lines()]))
+        return
+    # Write the array one element per line, holding back one element to know where the last comma goes
+    out_write("[")
+    previous = None
+    for line in input_lines():
+        with error_handler("json", {"Line": line}):
+            record = json_dumps(json_loads(line))
+        if previous is not None:
+            out_write(previous + ",")
+        previous = record
+    if previous is not None:
+        out_write(previous)
+    out_write("]")
+
+
+def sink_format(path, format=None):
+    if format is not None:
+        if format not in {f for _, f in SINK_FORMATS}:
+            raise Exception(f"Unknown output format: {format}, expected jsonl, jsonl.gz, jsonl.zst, arrow or parquet")
+        return format
+    for suffix, format in SINK_FORMATS:
+        if path.lower().endswith(suffix):
+            return format
+    raise Exception(f"Can't tell the output format from the file name {path}, use --format")
+
+
+def zstd_writer(stream, level):
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdFile(stream, "w", level=level)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression needs the zstandard package: pip install zstandard")
+    return zstandard.ZstdCompressor(level=level).stream_writer(stream, closefd=False)
+
+
+def import_pyarrow(format):
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(f"The {format} format needs the pyarrow package: pip install pyarrow")
+    return pyarrow
+
+
+class JsonLinesSink:
+    """
+    Writes JSON lines as they come, optionally through a gzip or zstd compressor.
+    """
+    parse = False
+
+    def __init__(self, stream, format, level=None):
+        self.stream = stream
+        if format == "jsonl.gz":
+            self.file = gzip.GzipFile(fileobj=stream, mode="wb",
+                                      compresslevel=level if level is not None else DEFAULT_GZIP_LEVEL)
+        elif format == "jsonl.zst":
+            self.file = zstd_writer(stream, level if level is not None else DEFAULT_ZSTD_LEVEL)
+        else:
+            self.file = None
+
+    def write_batch(self, lines):
+        (self.file or self.stream).write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def infer_sink_schema(records):
+    """
+    Infer the column types of a columnar file from the first batch of records: bool, int, float or string.
+    Columns mixing types, holding nested values or only nulls are strings, nested values are written as JSON.
+    """
+    kinds = {}
+    for record in records:
+        for key, value in record.items():
+            if value is None:
+                kinds.setdefault(key, None)
+                continue
+            kind = "bool" if isinstance(value, bool) else "int" if isinstance(value, int) \
+                else "float" if isinstance(value, float) else "string"
+            current = kinds.get(key)
+            if current is None or current == kind:
+                kinds[key] = kind
+            elif {current, kind} == {"int", "float"}:
+                kinds[key] = "float"
+            else:
+                kinds[key] = "string"
+    return [(key, kind or "string") for key, kind in kinds.items()]
+
+
+def sink_cell(value, kind):
+    """
+    Convert a value to a column kind of a columnar file, returns MISSING when it doesn't fit.
+    """
+    if kind == "string":
+        return value if isinstance(value, str) else json.dumps(value)
+    if isinstance(value, bool):
+        return value if kind == "bool" else MISSING
+    if kind == "bool":
+        return MISSING
+    if isinstance(value, str):
+        value = to_number(value.strip())
+        if value is None:
+            return MISSING
+    if not isinstance(value, (int, float)):
+        return MISSING
+    if kind == "float":
+        return float(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            return MISSING
+        value = int(value)
+    return value if -2 ** 63 <= value < 2 ** 63 else MISSING
+
+
+class ArrowSink:
+    """
+    Writes records to an Arrow IPC (Feather v2) or Parquet file in record batches, with the schema inferred
+    from the first batch. Fields first seen in later batches are dropped, bools in numeric columns are written as
+    1 and 0, and other values that don't fit their column are written as null, all with a warning.
+    """
+    parse = True
+
+    def __init__(self, stream, format, compression=None):
+        self.pyarrow = import_pyarrow(format)
+        self.stream = stream
+        self.format = format
+        self.compression = compression
+        self.columns = None
+        self.schema = None
+        self.writer = None
+        self.dropped_fields = set()
+        self.nulled_fields = set()
+        self.coerced_fields = set()
+
+    def _open(self, records):
+        pa = self.pyarrow
+        types = {"bool": pa.bool_(), "int": pa.int64(), "float": pa.float64(), "string": pa.string()}
+        self.columns = infer_sink_schema(records)
+        self.schema = pa.schema([(key, types[kind]) for key, kind in self.columns])
+        if self.format == "parquet":
+            self.writer = pa.parquet.ParquetWriter(self.stream, self.schema, compression=self.compression or "snappy")
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self.compression) if self.compression else None
+            self.writer = pa.ipc.new_file(self.stream, self.schema, options=options)
+
+    def _column(self, key, kind, records):
+        pa = self.pyarrow
+        arrow_type = self.schema.field(key).type
+        values = [record.get(key) for record in records]
+        if kind == "string":
+            values = [v if v is None or isinstance(v, str) else json.dumps(v) for v in values]
+        elif kind in ("int", "float"):
+            if any(isinstance(v, bool) for v in values):
+                # Pyarrow rejects bools in int columns and silently turns them into 1.0 in float ones
+                values = [int(v) if isinstance(v, bool) else v for v in values]
+                if key not in self.coerced_fields:
+                    self.coerced_fields.add(key)
+                    err_write(f"Field {key} has bool values in its {kind} column inferred from the first batch, "
+                              f"they are written as 1 and 0", Colors.FG_YELLOW)
+            if kind == "float":
+                values = [float(v) if isinstance(v, int) else v for v in values]
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+            pass
+        # Some values don't fit the column type, convert them one by one
+        converted = []
+        for value in values:
+            if value is not None:
+                value = sink_cell(value, kind)
+                if value is MISSING:
+                    value = None
+                    if key not in self.nulled_fields:
+                        self.nulled_fields.add(key)
+                        err_write(f"Field {key} has values that don't fit its {kind} column inferred from the "
+                                  f"first batch, they are written as null", Colors.FG_YELLOW)
+            converted.append(value)
+        return pa.array(converted, type=arrow_type)
+
+    def write_batch(self, records):
+        if self.writer is None:
+            self._open(records)
+        pa = self.pyarrow
+        arrays = [self._column(key, kind, records) for key, kind in self.columns]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        known = {key for key, _ in self.columns}
+        for record in records:
+            for key in record.keys() - known - self.dropped_fields:
+                self.dropped_fields.add(key)
+                err_write(f"Field {key} is not in the schema inferred from the first batch, it is dropped",
+                          Colors.FG_YELLOW)
+
+    def close(self):
+        if self.writer is None:
+            # Still write a valid, empty file
+            self._open([])
+        self.writer.close()
+
+
+def cmd_write(path, format=None, batch_rows=DEFAULT_SINK_BATCH_ROWS, level=None, compression=None):
+    with error_handler("write", {"Path": path, "Format": format}):
+        format = sink_format(path, format)
+        if path == "-":
+            sys.stdout.flush()
+            stream = sys.stdout.buffer
+        else:
+            stream = open(path, "wb")
+
+    sink = None
+    completed = False
+    try:
+        with error_handler("write", {"Path": path, "Format": format}):
+            if format in ("arrow", "parquet"):
+                sink = ArrowSink(stream, format, compression)
+            else:
+                sink = JsonLinesSink(stream, format, level)
+
+        batch = []
+        for line in input_lines():
+            with error_handler("write", {"Line": line, "Path": path}):
+                record = json_loads(line)
+                if sink.parse:
+                    if not isinstance(record, dict):
+                        raise Exception(f"Invalid data format, Expected a JSON object, got {type(record).__name__}")
+                    batch.append(record)
+                else:
+                    # Checked but written as is, so a copy is byte for byte the input
+                    batch.append(line)
+                if len(batch) >= batch_rows:
+                    sink.write_batch(batch)
+                    batch = []
+        with error_handler("write", {"Path": path, "Format": format}):
+            if batch:
+                sink.write_batch(batch)
+            sink.close()
+            completed = True
+    finally:
+        if not completed and sink is not None:
+            # Release the writer before its file goes away, the output is discarded anyway
+            try:
+                sink.close()
+            except Exception:
+                pass
+        if stream is sys.stdout.buffer:
+            stream.flush()
+        else:
+            stream.close()
+            # Don't leave a truncated file behind, Arrow and Parquet files can't even be opened without their footer
+            if not completed:
+                os.remove(path)
 
 
 def cmd_csv(ordered_fields=[]):
     with error_handler("csv", {}):
         # Collect all lines and their fields
-        data = [json_loads(line) for line in input_lines()]
-        if not data:
+        data = RecordStore().extend(json_loads(line) for line in input_lines())
+        report_store(data)
+        if not len(data):
             return
 
         if len(ordered_fields)==0:
-            # Get all unique fields across all records
-            fields = set()
-            for item in data:
-                fields.update(item.keys())
-            ordered_fields = sorted(list(fields))  # Sort fields for consistent column order
+            # Get all unique fields across all records, sorted for consistent column order
+            ordered_fields = sorted(data.all_keys())
 
         # Write header
         out_write(','.join(f'"{field}"' for field in ordered_fields))
 
         # Write data rows
-        for item in data:
+        for i in range(len(data)):
             row = []
             for field in ordered_fields:
-                value = item.get(field, '')
+                value = data.get(i, field, '')
                 # Escape quotes and special characters
                 if isinstance(value, str):
                     value = f'"{value.replace("`", "``")}"'
@@ -719,7 +2598,7 @@ def cmd_lookup(field, lookup_data_command, join_type="left"):
             left_data = [json_loads(line) for line in input_lines()]
             joined_data = join_dict_lists(left_data, right_data, field, join_type)
             for line in joined_data:
-                out_write(json.dumps(line))
+                out_write(json_dumps(line))
     else:
         with error_handler("lookup", {**common_err_context_info}):
             right_lookup = defaultdict(list)
@@ -734,60 +2613,67 @@ def cmd_lookup(field, lookup_data_command, join_type="left"):
                     if matches:
                         for ridx, r in enumerate(matches):
                             res = {**l, **r}
-                            out_write(json.dumps(res))
+                            out_write(json_dumps(res))
                     elif join_type == 'left':
-                        out_write(json.dumps(l))
+                        out_write(json_dumps(l))
 
 
 def cmd_group(group_keys):
     if not group_keys:
         err_write("No group keys specified")
         exit(1)
-    grouped = defaultdict(list)
+    grouped = defaultdict(lambda: array("I"))
+    remainders = RecordStore()
     for line in input_lines():
         with error_handler("group", {"Group Keys": group_keys, "Line": line}):
             line_data = NullSafeDict(json_loads(line))
             key = tuple(line_data[k] for k in group_keys)
             # Extract the rest of the fields
             remainder = {k: v for k, v in line_data.items() if k not in group_keys}
-            grouped[key].append(remainder)
+            grouped[key].append(remainders.append(remainder))
+    report_store(remainders)
 
-    result = []
     with error_handler("group", {"Group Keys": group_keys}):
-        for key, group_items in grouped.items():
+        for key, group_rows in grouped.items():
             grouped_entry = dict(zip(group_keys, key))
-            grouped_entry[GROUPED_KEY] = group_items
-            result.append(grouped_entry)
-
-        for r in result:
-            out_write(json.dumps(r))
+            grouped_entry[GROUPED_KEY] = list(remainders.rows(group_rows))
+            out_write(json_dumps(grouped_entry))
 
 
 def cmd_cluster(field, threshold):
     with error_handler("cluster", {"Field": field, "Threshold": threshold}):
         groups = defaultdict(list)
-        data = []
+        data = RecordStore()
         for line in input_lines():
             if field is None:
                 data.append({LINE_KEY: line})
             else:
                 data.append(json_loads(line))
+        report_store(data)
         field = field if field is not None else LINE_KEY
-        while data:
-            base = data.pop(0)
-            groups[base[field]].append(base)
-            similar = []
-            for s in data:
-                matcher = SequenceMatcher(None, base[field], s[field])
-                if matcher.ratio() > threshold:
-                    similar.append((s, matcher.ratio()))
-            for s in similar:
-                s, ratio = s
-                s[CLUSTER_RATIO_KEY] = ratio
-                groups[base[field]].append(s)
-                data.remove(s)
-        for key, value in groups.items():
-            out_write(json.dumps({field: key, GROUPED_KEY: value}))
+        if any(field not in data.schema_fields[schema] for schema in data.row_schemas):
+            raise KeyError(field)
+        values = data.columns[field].values if len(data) else []
+        remaining = list(range(len(data)))
+        while remaining:
+            base = remaining[0]
+            groups[values[base]].append((base, None))
+            rest = []
+            for s in remaining[1:]:
+                ratio = SequenceMatcher(None, values[base], values[s]).ratio()
+                if ratio > threshold:
+                    groups[values[base]].append((s, ratio))
+                else:
+                    rest.append(s)
+            remaining = rest
+        for key, members in groups.items():
+            grouped = []
+            for row, ratio in members:
+                item = data.row(row)
+                if ratio is not None:
+                    item[CLUSTER_RATIO_KEY] = ratio
+                grouped.append(item)
+            out_write(json_dumps({field: key, GROUPED_KEY: grouped}))
 
 
 def cmd_count():
@@ -805,73 +2691,608 @@ def cmd_fields(fields):
             filtered_data = {}
             for field in fields:
                 filtered_data[field] = line[field] if field in line else None
-            out_write(json.dumps(filtered_data))
+            out_write(json_dumps(filtered_data))
 
 
-def cmd_mul(line_pattern):
-    previous_line = None
-    for line in input_lines(strip=False):
-        with error_handler("fields", {"Line": line}):
-            if re.search(line_pattern, line, re.DOTALL):
-                if previous_line is not None:
-                    out_write(json.dumps({LINE_KEY: previous_line}))
-                previous_line = line
+def start_line_check(start_regex):
+    """
+    Return a function telling whether a line starts a new multiline event.
+    Patterns anchored with ^ only need to be tried at the line start, and their literal prefix
+    (e.g. "[" or "20") rejects most continuation lines with a plain startswith before running the regex.
+    """
+    try:
+        parsed = list(sre_parse.parse(start_regex.pattern, start_regex.flags))
+    except Exception:
+        parsed = []
+    if not parsed or parsed[0] != (sre_parse.AT, sre_parse.AT_BEGINNING) \
+            or start_regex.flags & (re.MULTILINE | re.IGNORECASE):
+        return start_regex.search
+    prefix = []
+    for op, av in parsed[1:]:
+        if op is not sre_parse.LITERAL:
+            break
+        prefix.append(chr(av))
+    match = start_regex.match
+    if not prefix:
+        return match
+    prefix = "".join(prefix)
+    return lambda line: line.startswith(prefix) and match(line)
+
+
+def mul_events(lines, line_pattern, ts_format=None, max_lines=None, max_bytes=None):
+    """
+    Group lines into multiline events and yield each event as a JSON line.
+    Lines are collected in a list and joined once per event. Past max_lines lines or max_bytes characters,
+    further lines of the event are dropped and their count is reported in the _truncated field.
+    """
+    start_regex = re.compile(line_pattern, re.DOTALL)
+    is_start = start_line_check(start_regex)
+    fragments = []
+    size = 0
+    dropped = 0
+    for line in lines:
+        if fragments and not is_start(line):
+            # Once a line is dropped the rest of the event is dropped too, so the kept lines stay contiguous
+            if dropped or (max_lines is not None and len(fragments) >= max_lines) or \
+                    (max_bytes is not None and size + len(line) + 1 > max_bytes):
+                dropped += 1
             else:
-                if previous_line is not None:
-                    previous_line += "\n" + line
+                fragments.append(line)
+                size += len(line) + 1
+            continue
+        if fragments:
+            yield mul_event(fragments, dropped, start_regex, ts_format)
+        fragments = [line]
+        size = len(line)
+        dropped = 0
+    if fragments:
+        yield mul_event(fragments, dropped, start_regex, ts_format)
+
+
+def mul_event(fragments, dropped, start_regex, ts_format):
+    with error_handler("mul", {"Line": fragments[0]}):
+        data = {LINE_KEY: "\n".join(fragments)}
+        if ts_format is not None:
+            data[DEFAULT_TIME_FIELD] = extract_time(fragments[0], start_regex, ts_format)
+        if dropped:
+            data[TRUNCATED_KEY] = dropped
+        return json_dumps(data)
+
+
+def mul_chunk_offsets(path, line_pattern, chunk_size):
+    """
+    Split a file into chunks of about chunk_size bytes, each one starting at a line matching the start pattern,
+    so that the chunks can be grouped into events independently.
+    """
+    is_start = start_line_check(re.compile(line_pattern, re.DOTALL))
+    file_size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as f:
+        offset = chunk_size
+        while offset < file_size:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+            while True:
+                position = f.tell()
+                raw_line = f.readline()
+                if not raw_line or is_start(raw_line.decode("utf-8", errors="replace").rstrip("\n")):
+                    break
+            if not raw_line:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+            offset = max(offset + chunk_size, position + 1)
+    offsets.append(file_size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def mul_file_chunk(path, start, end, line_pattern, ts_format, max_lines, max_bytes):
+    """
+    Group the lines of one file chunk into events, returns their JSON lines and the number of lines read.
+    The chunk is read line by line, so an event longer than the chunk size is held in memory only up to max_bytes.
+    """
+    line_count = 0
+
+    def chunk_lines(f):
+        nonlocal line_count
+        remaining = end - start
+        for raw_line in f:
+            if remaining <= 0:
+                return
+            remaining -= len(raw_line)
+            line_count += 1
+            # Only \n ends a line, a \r before it is kept as on stdin
+            line = raw_line.decode("utf-8", errors="replace")
+            yield line[:-1] if line.endswith("\n") else line
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        try:
+            return list(mul_events(chunk_lines(f), line_pattern, ts_format, max_lines, max_bytes)), line_count
+        except SystemExit:
+            # The error was already reported by error_handler, the parent process exits with it
+            return None, line_count
+
+
+def cmd_mul(line_pattern, ts_format=None, max_lines=None, max_bytes=None, paths=None, workers=None,
+            chunk_size=DEFAULT_MUL_CHUNK_KB):
+    with error_handler("mul", {"Pattern": line_pattern, "Files": paths}):
+        re.compile(line_pattern)
+    if not paths:
+        for event in mul_events(input_lines(strip=False), line_pattern, ts_format, max_lines, max_bytes):
+            out_write(event)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with error_handler("mul", {"Pattern": line_pattern, "Files": paths}):
+        chunk_size = max(1, chunk_size) * 1024
+        tasks = [(path, start, end, line_pattern, ts_format, max_lines, max_bytes)
+                 for path in paths for start, end in mul_chunk_offsets(path, line_pattern, chunk_size)]
+    if workers == 1 or len(tasks) == 1:
+        results = (mul_file_chunk(*task) for task in tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(min(workers, len(tasks)))
+        results = ordered_results(executor, mul_file_chunk, tasks, workers * 2)
+    try:
+        for task, (events, line_count) in zip(tasks, results):
+            if events is None:
+                exit(1)
+            if STATS is not None:
+                STATS.records_in += line_count
+                STATS.bytes_in += task[2] - task[1]
+            for event in events:
+                out_write(event)
+    finally:
+        # Cancel the chunks not started yet, e.g. when the reader closed the pipe, the running ones finish on their own
+        results.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def ordered_results(executor, func, tasks, max_pending):
+    """
+    Run the tasks in the executor and yield their results in task order,
+    with at most max_pending tasks submitted ahead of the consumer to bound memory.
+    """
+    pending = deque()
+    tasks = iter(tasks)
+    try:
+        for task in tasks:
+            pending.append(executor.submit(func, *task))
+            if len(pending) >= max_pending:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for task in tasks:
+                pending.append(executor.submit(func, *task))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class LRUCache:
+    """
+    Least recently used cache with an optional time to live in seconds, get returns MISSING for absent or
+    expired keys.
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires is not None and expires < time.monotonic():
+            del self.entries[key]
+            return MISSING
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl if self.ttl else None, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+def run_enrich_command(command_template, value):
+    argument = shlex.quote(value if isinstance(value, str) else json.dumps(value))
+    if "{}" in command_template:
+        command = command_template.replace("{}", argument)
+    else:
+        command = command_template + " " + argument
+    result = execute_command(command)
+    if not result['success']:
+        raise Exception(f"Error in the enrich command: {command} | {result['error']}")
+    output = result['output'].strip()
+    try:
+        return json.loads(output)
+    except ValueError:
+        return output
+
+
+def cmd_enrich(field, command_template, target_field=None, threads=CONCURRENT_THREAD_COUNT, ttl=None,
+               max_keys=DEFAULT_ENRICH_CACHE_SIZE):
+    """
+    Run the command once per distinct value of the field, in a thread pool, and add its output to the records.
+    Records wait in a bounded queue for their value's result so that the output keeps the input order.
+    """
+    common_err_context_info = {"Field": field, "Command": command_template}
+    cache = LRUCache(max_keys, ttl)
+    in_flight = {}
+    pending = deque()
+    max_pending = threads * ENRICH_PENDING_PER_THREAD
+    calls = 0
+    cache_hits = 0
+
+    def write(record, key, future, result):
+        if future is not None:
+            with error_handler("enrich", {**common_err_context_info, "Value": record.get(field)}):
+                result = future.result()
+            if in_flight.get(key) is future:
+                del in_flight[key]
+                cache.put(key, result)
+        if result is not MISSING:
+            if target_field is None and isinstance(result, dict):
+                record.update(result)
+            else:
+                record[target_field or f"{field}_enriched"] = result
+        out_write(json_dumps(record))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for line in input_lines():
+            with error_handler("enrich", {**common_err_context_info, "Line": line}):
+                record = json_loads(line)
+                value = record.get(field)
+                # The type is part of the key, as True, 1 and 1.0 are equal dict keys but different inputs
+                key = value if isinstance(value, str) else (type(value).__name__, json.dumps(value, sort_keys=True))
+                future = None
+                result = MISSING
+                if value is None:
+                    # Records without the field are written unchanged
+                    pass
+                elif key in in_flight:
+                    future = in_flight[key]
+                    cache_hits += 1
                 else:
-                    previous_line = line
-    if previous_line is not None:
-        out_write(json.dumps({LINE_KEY: previous_line}))
+                    result = cache.get(key)
+                    if result is MISSING:
+                        future = in_flight[key] = executor.submit(run_enrich_command, command_template, value)
+                        calls += 1
+                    else:
+                        cache_hits += 1
+                pending.append((record, key, future, result))
+            if len(pending) >= max_pending:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+    if STATS is not None:
+        STATS.extra["enrich_calls"] = calls
+        STATS.extra["enrich_cache_hits"] = cache_hits
 
 
-def cmd_graph(x_fields, y_fields, width=100):
+class GraphAggregate:
+    """
+    Running aggregate of one y field for one graph label, mergeable so that histogram bins can be combined.
+    """
+    __slots__ = ("value", "count")
+
+    def __init__(self):
+        self.value = None
+        self.count = 0
+
+    def add(self, agg, value):
+        self.count += 1
+        if agg == "count":
+            return
+        value = to_number(value)
+        if value is None or not math.isfinite(value):
+            self.count -= 1
+        elif self.value is None or agg == "last":
+            self.value = value
+        elif agg == "sum" or agg == "avg":
+            self.value += value
+        elif agg == "max":
+            self.value = max(self.value, value)
+        elif agg == "min":
+            self.value = min(self.value, value)
+
+    def merge(self, agg, other):
+        if other.value is not None:
+            if self.value is None or agg == "last":
+                self.value = other.value
+            elif agg == "sum" or agg == "avg":
+                self.value += other.value
+            elif agg == "max":
+                self.value = max(self.value, other.value)
+            elif agg == "min":
+                self.value = min(self.value, other.value)
+        self.count += other.count
+
+    def result(self, agg):
+        if agg == "count":
+            return self.count
+        if agg == "avg":
+            return round(self.value / self.count, 4) if self.count else 0
+        return self.value or 0
+
+
+class GraphBins:
+    """
+    Histogram of a numeric field whose range is not known up front, drawn as `bins` bins.
+    Values are counted in `bins * GRAPH_BIN_RESOLUTION` fine slots: the first values are buffered to pick the
+    initial range, then the slots double their width, merging pairs of neighbours, whenever a value falls
+    outside. The occupied slots are grouped into the drawn bins at the end, so the bins span the values actually
+    seen whatever the growth steps.
+    """
+
+    def __init__(self, bins, agg, y_fields, buffer_size=1000):
+        self.bins = bins
+        self.slots = bins * GRAPH_BIN_RESOLUTION
+        self.agg = agg
+        self.y_fields = y_fields
+        self.buffer = []
+        self.buffer_size = max(buffer_size, bins)
+        self.origin = None
+        self.width = None
+        self.aggregates = {}
+        self.min_value = None
+        self.max_value = None
+
+    def add(self, x, item):
+        if self.min_value is None or x < self.min_value:
+            self.min_value = x
+        if self.max_value is None or x > self.max_value:
+            self.max_value = x
+        if self.origin is None:
+            self.buffer.append((x, item))
+            if len(self.buffer) >= self.buffer_size:
+                self._start()
+            return
+        index = math.floor((x - self.origin) / self.width)
+        while index < 0 or index >= self.slots:
+            if index < 0:
+                # Pair each slot with its left neighbour, which extends the range by one slot to the left
+                self.origin -= self.width
+                self._merge_pairs(1)
+                index = (index + 1) // 2
+            else:
+                self._merge_pairs(0)
+                index //= 2
+            self.width *= 2
+        aggregates = self.aggregates.get(index)
+        if aggregates is None:
+            aggregates = self.aggregates[index] = [GraphAggregate() for _ in self.y_fields]
+        for aggregate, y_field in zip(aggregates, self.y_fields):
+            aggregate.add(self.agg, item.get(y_field))
+
+    def _start(self):
+        values = [x for x, _ in self.buffer]
+        self.origin = min(values)
+        self.width = (max(values) - self.origin) / self.slots or 1
+        # Widen slightly so that the maximum falls in the last slot
+        self.width *= 1 + 1e-9
+        buffer, self.buffer = self.buffer, []
+        for x, item in buffer:
+            self.add(x, item)
+
+    def _merge_pairs(self, shift):
+        merged = {}
+        for index, aggregates in self.aggregates.items():
+            target = merged.get((index + shift) // 2)
+            if target is None:
+                merged[(index + shift) // 2] = aggregates
+            else:
+                for aggregate, other in zip(target, aggregates):
+                    aggregate.merge(self.agg, other)
+        self.aggregates = merged
+
+    def rows(self):
+        if self.origin is None:
+            if not self.buffer:
+                return []
+            self._start()
+        if not self.aggregates:
+            return []
+        first = min(self.aggregates)
+        occupied = max(self.aggregates) - first + 1
+        groups = min(self.bins, occupied)
+        rows = []
+        for group in range(groups):
+            # Bins are groups of whole slots, their widths differ by at most one slot
+            start = first + group * occupied // groups
+            end = first + (group + 1) * occupied // groups
+            aggregates = [GraphAggregate() for _ in self.y_fields]
+            for index in range(start, end):
+                for aggregate, other in zip(aggregates, self.aggregates.get(index, ())):
+                    aggregate.merge(self.agg, other)
+            # The outer bounds are the smallest and largest values seen rather than the slot edges
+            low = self.min_value if group == 0 else self.origin + start * self.width
+            if group == groups - 1:
+                label = f"[{low:.6g}, {self.max_value:.6g}]"
+            else:
+                label = f"[{low:.6g}, {self.origin + end * self.width:.6g})"
+            rows.append((label, [a.result(self.agg) for a in aggregates]))
+        return rows
+
+
+def graph_lines(rows, y_fields, width):
+    yfield_color = {}
+    for idx, y_field in enumerate(y_fields):
+        yfield_color[y_field] = FOREGROUND_COLORS[idx % len(FOREGROUND_COLORS)]
+
+    max_per_field = [max((values[i] for _, values in rows), default=0) for i in range(len(y_fields))]
+    longest_label = max((len(label) for label, _ in rows), default=0)
+    y_field_name_len = max((len(y) for y in y_fields), default=0)
+
+    lines = []
+    for label, values in rows:
+        for i, y_field in enumerate(y_fields):
+            value = values[i]
+            max_value = max_per_field[i] or 1  # Avoid division by zero
+            bar_len = int((value / max_value) * width) if max_value else 0
+            bar = '#' * bar_len
+            color = yfield_color[y_field]
+            # Only write the label on the first y_field row per label group
+            label_to_write = label if i == 0 else ' ' * longest_label
+            lines.append(
+                f"{label_to_write:>{longest_label}} | {y_field:>{y_field_name_len}}: {color}{bar}{Colors.RESET.value} ({value})")
+    return lines
+
+
+def cmd_graph(x_fields, y_fields, width=100, agg="sum", limit=None, bins=None, live_interval=None, exact=False):
     with error_handler("graph", {"X Fields": x_fields, "Y Fields": y_fields, "Width": width}):
         x_fields = x_fields.split(",")
         y_fields = y_fields.split(",")
+        if agg not in GRAPH_AGGREGATES:
+            raise Exception(f"Unknown aggregate: {agg}, expected one of {', '.join(GRAPH_AGGREGATES)}")
+        if bins is not None and len(x_fields) != 1:
+            raise Exception("Binning needs a single numeric x field")
+        if bins is not None and bins < 1:
+            raise Exception(f"The number of bins must be at least 1, got {bins}")
+        if limit is not None and limit < 1:
+            raise Exception(f"The number of labels (-n) must be at least 1, got {limit}")
+        histogram = GraphBins(bins, agg, y_fields) if bins is not None else None
+        aggregates_per_label = {}
+        # With a limit on sum or count, only the labels of a Space-Saving sketch of the first y field are kept
+        sketch = SpaceSaving(max(limit * SKETCH_CAPACITY_FACTOR, MIN_SKETCH_CAPACITY)) \
+            if limit is not None and agg in ("sum", "count") and not exact and histogram is None else None
+
+    def rows():
+        if histogram is not None:
+            return histogram.rows()
+        label_rows = [(label, [a.result(agg) for a in aggregates])
+                      for label, aggregates in aggregates_per_label.items()]
+        if limit is not None:
+            label_rows = heapq.nlargest(limit, label_rows, key=lambda row: row[1][0] if y_fields else 0)
+        return label_rows
+
+    def draw():
+        lines = graph_lines(rows(), y_fields, width)
+        if live_interval is not None:
+            # Redraw in place on terminals, separate the frames with a blank line otherwise
+            out_write("\033[H\033[J" if sys.stdout.isatty() else "")
+        for line in lines:
+            out_write(line)
 
-        data = [json_loads(line) for line in input_lines()]
-
-        value_map = OrderedDict()
-        labels = []
-        for item in data:
-            label = " | ".join(
-                str(item.get(field, "null")) if item.get(field) is not None else "null" for field in x_fields)
-            if label not in value_map:
-                value_map[label] = OrderedDict()
-                labels.append(label)
-            for y_field in y_fields:
-                value_map[label][y_field] = item.get(y_field, 0) or 0
-
-        yfield_color = {}
-        for idx, y_field in enumerate(y_fields):
-            yfield_color[y_field] = FOREGROUND_COLORS[idx % len(FOREGROUND_COLORS)]
-
-        max_per_field = {y: max((value_map[label][y] for label in labels), default=0) for y in y_fields}
-        longest_label = max((len(label) for label in labels), default=0)
-        y_field_name_len = max((len(y) for y in y_fields), default=0)
-
-        for label in labels:
-            for i, y_field in enumerate(y_fields):
-                value = value_map[label][y_field]
-                max_value = max_per_field[y_field] or 1  # Avoid division by zero
-                bar_len = int((value / max_value) * width) if max_value else 0
-                bar = '#' * bar_len
-                color = yfield_color[y_field]
-                # Only write the label on the first y_field row per label group
-                label_to_write = label if i == 0 else ' ' * longest_label
-                out_write(
-                    f"{label_to_write:>{longest_label}} | {y_field:>{y_field_name_len}}: {color}{bar}{Colors.RESET.value} ({value})")
+    next_draw = time.monotonic() + live_interval if live_interval is not None else None
+    for line in input_lines():
+        with error_handler("graph", {"Line": line, "X Fields": x_fields, "Y Fields": y_fields}):
+            item = json_loads(line)
+            if histogram is not None:
+                x = to_number(item.get(x_fields[0]))
+                # "nan" and "inf" parse as numbers but have no bin
+                if x is not None and math.isfinite(x):
+                    histogram.add(x, item)
+            else:
+                label = " | ".join(
+                    str(item.get(field, "null")) if item.get(field) is not None else "null" for field in x_fields)
+                if sketch is not None:
+                    weight = 1 if agg == "count" else max(to_number(item.get(y_fields[0], 0) or 0) or 0, 0)
+                    evicted = sketch.add(label, weight)
+                    if evicted is not None:
+                        del aggregates_per_label[evicted]
+                aggregates = aggregates_per_label.get(label)
+                if aggregates is None:
+                    aggregates = aggregates_per_label[label] = [GraphAggregate() for _ in y_fields]
+                for aggregate, y_field in zip(aggregates, y_fields):
+                    aggregate.add(agg, item.get(y_field, 0) or 0)
+        if next_draw is not None and time.monotonic() >= next_draw:
+            draw()
+            next_draw = time.monotonic() + live_interval
+    with error_handler("graph", {"X Fields": x_fields, "Y Fields": y_fields, "Width": width}):
+        draw()
 
 
 def cmd_gen(expr):
     with error_handler("gen", {"Expression": expr}):
         data = safe_eval(expr, {})
-        if isinstance(data, list):
+        # Generators and ranges are streamed instead of being materialized, other values such as tuples stay one record
+        if isinstance(data, (list, range)) or hasattr(data, "__next__"):
             for line in data:
-                out_write(json.dumps(line))
+                out_write(json_dumps(line))
         else:
-            out_write(json.dumps(data))
+            out_write(json_dumps(data))
+
+
+def cmd_dc(fields, precision=DEFAULT_HLL_PRECISION, exact=False, sketch=False):
+    if not fields:
+        err_write("No fields specified")
+        exit(1)
+    with error_handler("dc", {"Fields": fields, "Precision": precision}):
+        counters = {f: set() if exact else HyperLogLog(precision) for f in fields}
+    for line in input_lines():
+        with error_handler("dc", {"Line": line, "Fields": fields}):
+            data = json_loads(line)
+            for f in fields:
+                value = data.get(f)
+                if value is not None:
+                    counters[f].add(sketch_value(value) if exact else value)
+    with error_handler("dc", {"Fields": fields}):
+        for f, counter in counters.items():
+            result = {"field": f, "distinct_count": len(counter) if exact else counter.count()}
+            if sketch and not exact:
+                result.update(counter.to_json())
+            out_write(json_dumps(result))
+
+
+def cmd_dc_merge():
+    merged = OrderedDict()
+    for line in input_lines():
+        with error_handler("dc", {"Line": line}):
+            data = json_loads(line)
+            if HLL_KEY not in data:
+                raise Exception("Line is not a dc sketch, create sketches with: lgx dc <fields> --sketch")
+            counter = HyperLogLog.from_json(data)
+            if data["field"] in merged:
+                merged[data["field"]].merge(counter)
+            else:
+                merged[data["field"]] = counter
+    with error_handler("dc", {}):
+        for f, counter in merged.items():
+            out_write(json_dumps({"field": f, "distinct_count": counter.count(), **counter.to_json()}))
+
+
+def cmd_top(fields, limit=DEFAULT_TOP_LIMIT, exact=False, rare=False):
+    if not fields:
+        err_write("No fields specified")
+        exit(1)
+    action = "rare" if rare else "top"
+    capacity = max(limit * SKETCH_CAPACITY_FACTOR, MIN_SKETCH_CAPACITY)
+    if exact:
+        counter = Counter()
+    else:
+        counter = RareItems(capacity) if rare else SpaceSaving(capacity)
+    for line in input_lines():
+        with error_handler(action, {"Line": line, "Fields": fields}):
+            data = json_loads(line)
+            # JSON encoded keys are hashable and comparable whatever the value types (missing, mixed, lists ...)
+            key = json.dumps([data.get(f) for f in fields], sort_keys=True)
+            if exact:
+                counter[key] += 1
+            else:
+                counter.add(key)
+    with error_handler(action, {"Fields": fields}):
+        if exact:
+            items = counter.most_common()[::-1][:limit] if rare else counter.most_common(limit)
+            items = [(item, count, None) for item, count in items]
+        else:
+            items = counter.rare(limit) if rare else counter.top(limit)
+        for key, count, error in items:
+            result = dict(zip(fields, json.loads(key)))
+            result["count"] = count
+            if error:
+                result["count_error"] = error
+            out_write(json_dumps(result))
 
 
 def cmd_dedup(fields):
@@ -891,18 +3312,246 @@ def cmd_accum(fields):
             data = NullSafeDict(json_loads(line))
             for f in fields:
                 current_value = accum_data[f] if f in accum_data else 0
-                data[f] = current_value + data[f]
+                data[f] = current_value + (data[f] or 0)
                 accum_data[f] = data[f]
-            out_write(json.dumps(data))
+            out_write(json_dumps(data))
+
+def cmd_streamstats(tokens, window=None, time_field=DEFAULT_TIME_FIELD):
+    with error_handler("streamstats", {"Aggregates": " ".join(tokens), "Window": window}):
+        aggregates, by_fields = parse_stream_aggregates(tokens)
+        window_count, window_ms = parse_window(window)
+        bounded = window_count is not None or window_ms is not None
+        value_fields = sorted(set(field for _, field, _ in aggregates if field is not None))
+        partitions = {}
+    for line in input_lines():
+        with error_handler("streamstats", {"Aggregates": " ".join(tokens), "Line": line}):
+            data = json_loads(line)
+            key = tuple(data.get(f) for f in by_fields)
+            partition = partitions.get(key)
+            if partition is None:
+                partition = partitions[key] = StreamPartition(value_fields, bounded)
+            partition.seq += 1
+            seq = partition.seq
+            ts = to_number(data.get(time_field))
+            if window_ms is not None and ts is None:
+                raise Exception(f"Time window requires a numeric epoch ms '{time_field}' field, set it with --time=<field>")
+
+            partition.records.push(seq, ts, 1)
+            for f in value_fields:
+                value = to_number(data.get(f))
+                if value is not None:
+                    partition.windows[f].push(seq, ts, value)
+            if bounded:
+                min_seq = seq - window_count + 1 if window_count is not None else 0
+                min_ts = ts - window_ms if window_ms is not None else None
+                partition.records.evict(min_seq, min_ts)
+                for w in partition.windows.values():
+                    w.evict(min_seq, min_ts)
+
+            for agg, field, name in aggregates:
+                if agg == "derivative":
+                    value = to_number(data.get(field))
+                    previous = partition.previous.get(field)
+                    result = None
+                    if value is not None:
+                        if previous is not None:
+                            previous_ts, previous_value = previous
+                            if ts is not None and previous_ts is not None:
+                                result = (value - previous_value) / ((ts - previous_ts) / 1000) \
+                                    if ts != previous_ts else None
+                            else:
+                                result = value - previous_value
+                        partition.previous[field] = (ts, value)
+                    data[name] = result
+                elif field is None:
+                    if agg == "count":
+                        data[name] = partition.records.count
+                    else:
+                        # Records per second over the window
+                        records = partition.records
+                        span = window_ms if window_ms is not None else \
+                            (records.last[1] - records.first[1]) if ts is not None and records.first[1] is not None else None
+                        data[name] = records.count / (span / 1000) if span else None
+                else:
+                    data[name] = partition.windows[field].value(agg, window_ms)
+            out_write(json_dumps(data))
+
+
+def cmd_sample(size=None, probability=None, by_fields=None, seed=None, paths=None, block_size=DEFAULT_SAMPLE_BLOCK_KB):
+    with error_handler("sample", {"Size": size, "Probability": probability, "By": by_fields}):
+        if (size is None) == (probability is None):
+            raise Exception("Specify either a sample size with -n or a sampling rate with -p")
+        if probability is not None and not 0 < probability <= 1:
+            raise Exception("Sampling rate must be between 0 and 1")
+        if by_fields and size is None:
+            raise Exception("Stratified sampling requires a sample size per group with -n")
+        rng = random.Random(seed)
+        lines = sample_file_blocks(paths, size, probability, block_size, rng) if paths else input_lines()
+
+    if probability is not None and paths:
+        for line in lines:
+            out_write(line)
+        return
+
+    if probability is not None:
+        for line in bernoulli_sample(lines, probability, rng):
+            out_write(line)
+        return
+
+    reservoirs = {}
+    for line in lines:
+        with error_handler("sample", {"Line": line, "By": by_fields}):
+            if by_fields:
+                data = json_loads(line)
+                key = tuple(data.get(f) for f in by_fields)
+            else:
+                key = None
+            reservoir = reservoirs.get(key)
+            if reservoir is None:
+                reservoir = reservoirs[key] = Reservoir(size, rng)
+            reservoir.add(line)
+    for reservoir in reservoirs.values():
+        for line in reservoir.sample():
+            out_write(line)
+
+
+def bernoulli_sample(lines, probability, rng):
+    skips = bernoulli_skips(probability, rng)
+    skip = next(skips)
+    for line in lines:
+        if skip:
+            skip -= 1
+            continue
+        yield line
+        skip = next(skips)
+
+
+def sample_file_blocks(paths, size, probability, block_size, rng):
+    """
+    Yield the lines of randomly chosen blocks of the files instead of reading them completely.
+    With a sampling rate, that fraction of blocks is read and all their lines are part of the sample.
+    Files of fewer than MIN_SAMPLE_BLOCKS blocks are read completely and their lines sampled one by one,
+    as the number of chosen blocks would vary too much (with -p 0.1 and 5 blocks, no block at all 59% of the time).
+    With a sample size, enough blocks are read to fill the reservoir a few times over.
+    """
+    block_size *= 1024
+    for path in paths:
+        file_size = os.path.getsize(path)
+        block_count = max(1, math.ceil(file_size / block_size))
+        if probability is not None and block_count < MIN_SAMPLE_BLOCKS:
+            yield from bernoulli_sample(file_block_lines(path, 0, file_size), probability, rng)
+            continue
+        if probability is not None:
+            chosen = [b for b in range(block_count) if rng.random() < probability]
+        else:
+            # Estimate the lines per block from the first block to decide how many blocks are needed
+            lines_per_block = max(1, sum(1 for _ in file_block_lines(path, 0, block_size)))
+            needed = min(block_count, math.ceil(size / lines_per_block) * 4)
+            chosen = sorted(rng.sample(range(block_count), needed))
+        for block in chosen:
+            for line in file_block_lines(path, block * block_size, min((block + 1) * block_size, file_size)):
+                yield line
+
 
 def cmd_highlight(text_list):
+    with error_handler("highlight", {"Text List": text_list}):
+        text_colors = {}
+        for i, text in enumerate(text_list):
+            text_colors.setdefault(text, ALL_COLORS[i % len(ALL_COLORS)])
+        # Without terms the lines pass through unchanged
+        pattern = compile_literals(text_list) if text_list else None
+
+    def colorize(match):
+        text = match.group(0)
+        return f"{text_colors[text]}{text}{Colors.RESET.value}"
+
     for line in input_lines(strip=False):
         with error_handler("highlight", {"Text List": text_list}):
-            for i in range(len(text_list)):
-                text = text_list[i]
-                color = ALL_COLORS[i % len(ALL_COLORS)]
-                line = line.replace(text, f"{color}{text}{Colors.RESET.value}")
-            out_write(line)
+            out_write(pattern.sub(colorize, line) if pattern is not None else line)
+
+def cmd_index(path, time_regex, time_format, every=DEFAULT_INDEX_EVERY_KB, line_pattern=None):
+    with error_handler("index", {"File": path, "Time Regex": time_regex, "Time Format": time_format}):
+        if not time_regex or not time_format:
+            raise Exception("Both --time-regex and --time-format are required")
+        settings = {"time_regex": time_regex, "time_format": time_format, "every": every, "mul": line_pattern}
+        index = load_time_index(path)
+        if index is None or any(index.get(k) != v for k, v in settings.items()) or time_index_stale(path, index):
+            # No usable index, the file was replaced/truncated/rewritten or the settings changed: rebuild from scratch
+            index = new_time_index(settings)
+        previous_entries = len(index["entries"])
+        scan_time_index(path, index)
+        save_time_index(path, index)
+        out_write(json_dumps({
+            "index": time_index_path(path),
+            "entries": len(index["entries"]),
+            "new_entries": len(index["entries"]) - previous_entries,
+            "indexed_bytes": index["size"]
+        }))
+
+
+def cmd_index_terms(paths, block_size=DEFAULT_TERM_BLOCK_KB):
+    for path in paths:
+        with error_handler("index", {"File": path, "Block Size": block_size}):
+            index = build_term_index(path, block_size)
+            out_write(json_dumps({
+                "index": term_index_path(path),
+                "blocks": len(index["blocks"]),
+                "terms": len(index["postings"])
+            }))
+
+
+def cmd_read(path, time_from=None, time_to=None):
+    with error_handler("read", {"File": path, "From": time_from, "To": time_to}):
+        index = load_time_index(path)
+        if (time_from is not None or time_to is not None) and index is None:
+            raise Exception(f"No time index found for {path}, create one with: lgx index {path} ...")
+        offset = 0
+        if index is not None:
+            stale_reason = time_index_stale(path, index)
+            if stale_reason:
+                # The indexed offsets point into a different file, seeking them would silently skip lines
+                err_write(f"Time index of {path} is stale ({stale_reason}), rebuilding it", Colors.FG_YELLOW)
+                index = scan_time_index(path, new_time_index({k: index[k] for k in TIME_INDEX_SETTINGS}))
+                save_time_index(path, index)
+            time_format = index["time_format"]
+            time_regex = re.compile(index["time_regex"], re.DOTALL)
+            start_regex = re.compile(index["mul"], re.DOTALL) if index.get("mul") else None
+            time_from = parse_time_bound(time_from, time_format)
+            time_to = parse_time_bound(time_to, time_format)
+            if time_from is not None and index["entries"]:
+                # Entries are assumed to be in time order; start at the last entry before the lower bound
+                position = bisect.bisect_left([e[0] for e in index["entries"]], time_from)
+                offset = index["entries"][position - 1][1] if position > 0 else 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            if index is None:
+                for raw_line in f:
+                    out_write(raw_line.decode("utf-8", errors="replace").rstrip("\r\n"))
+                return
+            in_range = time_from is None
+            for raw_line in f:
+                line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+                if start_regex is None or start_regex.search(line):
+                    ts = extract_time(line, time_regex, time_format)
+                    if ts is not None:
+                        if time_to is not None and ts > time_to:
+                            break
+                        in_range = time_from is None or ts >= time_from
+                # Lines without a timestamp belong to the preceding event
+                if in_range:
+                    out_write(line)
+
+
+def cmd_cache(sub_command, size_limit_mb=DEFAULT_CACHE_SIZE_MB):
+    with error_handler("cache", {"Sub Command": sub_command}):
+        cache = ResultCache(size_limit_mb=size_limit_mb)
+        if sub_command == "stats":
+            out_write(json_dumps(cache.stats()))
+        elif sub_command == "clear":
+            out_write(json_dumps({"removed_entries": cache.clear()}))
+        else:
+            raise Exception("Unknown cache command, expected stats or clear")
+
 
 def cmd_upgrade():
     with error_handler("upgrade"):
@@ -922,11 +3571,42 @@ sys.stdout.reconfigure(line_buffering=True)
 
 if __name__ == '__main__':
     args = sys.argv[1:]
+    stats_interval = pop_option(args, "--stats")
+    if "--stats" in args:
+        args.remove("--stats")
+        stats_interval = 0
+    profile_path = pop_option(args, "--profile")
+    if "--profile" in args:
+        args.remove("--profile")
+        profile_path = ""
     action = args[0] if len(args) > 0 else "help"
+    if stats_interval is not None:
+        STATS = Stats(action, float(stats_interval))
+        atexit.register(STATS.report)
+    if profile_path is not None:
+        atexit.register(stop_profiler, start_profiler(), profile_path or f"lgx-{action}.prof")
+    cache_size = int(pop_option(args, "--cache-size", default=DEFAULT_CACHE_SIZE_MB))
+    cache_writer = None
+    if "--cache" in args:
+        args.remove("--cache")
+        if action not in UNCACHED_COMMANDS:
+            with error_handler(action, {"Parameters": args[1:], "Cache": CACHE_DIR}):
+                result_cache = ResultCache(size_limit_mb=cache_size)
+                read_stdin = action not in NO_INPUT_COMMANDS and not any(a.startswith("--file=") for a in args)
+                cache_key = result_cache.key(args, read_stdin)
+            if cache_key is None:
+                err_write("Input is a live stream, --cache is ignored", Colors.FG_YELLOW)
+            else:
+                with error_handler(action, {"Parameters": args[1:], "Cache": CACHE_DIR}):
+                    if result_cache.replay(cache_key):
+                        sys.exit(0)
+                    cache_writer = sys.stdout = result_cache.writer(cache_key)
+                    atexit.register(cache_writer.discard)
     with error_handler(action, {"Parameters": args[1:]}) as err_context_info:
         if action == "help":
             cmd_help()
         elif action == "rex":
+            ts_format = pop_option(args, "--ts")
             regex = args[1]
             input_field = None
             for arg in args[2:]:
@@ -936,16 +3616,39 @@ if __name__ == '__main__':
                 elif arg.startswith("--input_field="):  # For backward compatibility
                     input_field = arg.split("=", 1)[1]
                     break
-            cmd_rex(regex, input_field)
+            cmd_rex(regex, input_field, ts_format)
         elif action == "mul":
+            ts_format = pop_option(args, "--ts")
+            max_lines = pop_option(args, "--max-lines")
+            max_bytes = pop_option(args, "--max-bytes")
+            paths = pop_options(args, "--file")
+            workers = pop_option(args, "--workers")
+            chunk_size = int(pop_option(args, "--chunk", default=DEFAULT_MUL_CHUNK_KB))
             line_pattern = args[1]
-            cmd_mul(line_pattern)
+            cmd_mul(
+                line_pattern,
+                ts_format,
+                int(max_lines) if max_lines is not None else None,
+                int(max_bytes) if max_bytes is not None else None,
+                paths,
+                int(workers) if workers is not None else None,
+                chunk_size
+            )
         elif action == "match":
-            regex = args[1]
-            cmd_match(regex)
+            paths = pop_options(args, "--file")
+            if args[1] == "--any":
+                cmd_match_any(args[2:], paths)
+            elif args[1].startswith("-f="):
+                cmd_match_any(read_terms_file(args[1].split("=", 1)[1]), paths)
+            elif args[1] == "-f":
+                cmd_match_any(read_terms_file(args[2]), paths)
+            else:
+                regex = args[1]
+                cmd_match(regex, paths)
         elif action == "where":
+            paths = pop_options(args, "--file")
             expr = args[1]
-            cmd_where(expr)
+            cmd_where(expr, paths)
         elif action == "eval":
             expr = args[1]
             cmd_eval(expr)
@@ -979,24 +3682,107 @@ if __name__ == '__main__':
             cmd_fields(args[1:])
         elif action == "table":
             cmd_table(args[1:])
+        elif action == "dc":
+            precision = int(pop_option(args, "-p", "--precision", default=DEFAULT_HLL_PRECISION))
+            exact = "--exact" in args
+            sketch = "--sketch" in args
+            if "--merge" in args:
+                cmd_dc_merge()
+            else:
+                cmd_dc([a for a in args[1:] if a not in ("--exact", "--sketch")], precision, exact, sketch)
+        elif action == "top" or action == "rare":
+            limit = int(pop_option(args, "-n", default=DEFAULT_TOP_LIMIT))
+            exact = "--exact" in args
+            cmd_top([a for a in args[1:] if a != "--exact"], limit, exact, rare=action == "rare")
         elif action == "dedup":
             cmd_dedup(args[1:])
+        elif action == "streamstats":
+            window = pop_option(args, "-w", "--window", "window")
+            time_field = pop_option(args, "--time", default=DEFAULT_TIME_FIELD)
+            cmd_streamstats(args[1:], window, time_field)
+        elif action == "sample":
+            size = pop_option(args, "-n")
+            probability = pop_option(args, "-p")
+            seed = pop_option(args, "--seed")
+            paths = pop_options(args, "--file")
+            block_size = int(pop_option(args, "--block", default=DEFAULT_SAMPLE_BLOCK_KB))
+            by_fields = args[args.index("by") + 1:] if "by" in args else []
+            cmd_sample(
+                int(size) if size is not None else None,
+                float(probability) if probability is not None else None,
+                by_fields,
+                int(seed) if seed is not None else None,
+                paths,
+                block_size
+            )
         elif action == "accum":
             cmd_accum(args[1:])
         elif action == "highlight":
             cmd_highlight(args[1:])
         elif action == "json":
-            cmd_json()
+            cmd_json(stream="--stream" in args)
+        elif action == "write":
+            format = pop_option(args, "--format")
+            batch_rows = int(pop_option(args, "--batch", default=DEFAULT_SINK_BATCH_ROWS))
+            level = pop_option(args, "--level")
+            compression = pop_option(args, "--compression")
+            cmd_write(args[1], format, batch_rows, int(level) if level is not None else None, compression)
         elif action == "csv":
             cmd_csv(args[1:])
+        elif action == "enrich":
+            target_field = pop_option(args, "--as")
+            threads = int(pop_option(args, "--threads", default=CONCURRENT_THREAD_COUNT))
+            ttl = pop_option(args, "--ttl")
+            max_keys = int(pop_option(args, "--max-keys", default=DEFAULT_ENRICH_CACHE_SIZE))
+            cmd_enrich(args[1], args[2], target_field, threads, float(ttl) if ttl is not None else None, max_keys)
         elif action == "lookup":
             cmd_lookup(args[1], args[2], args[3] if len(args) > 3 else "left")
         elif action == "graph":
-            cmd_graph(args[1], args[2], int(args[3]) if len(args) > 3 else 100)
+            exact = "--exact" in args
+            if exact:
+                args.remove("--exact")
+            agg = pop_option(args, "--agg", default="sum")
+            limit = pop_option(args, "-n", "--top")
+            bins = pop_option(args, "--bins")
+            live_interval = pop_option(args, "--live")
+            if "--live" in args:
+                args.remove("--live")
+                live_interval = 1
+            cmd_graph(
+                args[1],
+                args[2],
+                int(args[3]) if len(args) > 3 else 100,
+                agg,
+                int(limit) if limit is not None else None,
+                int(bins) if bins is not None else None,
+                float(live_interval) if live_interval is not None else None,
+                exact
+            )
         elif action == "gen":
             expr = args[1]
             cmd_gen(expr)
+        elif action == "index" and "--terms" in args:
+            args.remove("--terms")
+            block_size = int(pop_option(args, "--block", default=DEFAULT_TERM_BLOCK_KB))
+            cmd_index_terms(args[1:], block_size)
+        elif action == "index":
+            every = int(pop_option(args, "--every", default=DEFAULT_INDEX_EVERY_KB))
+            time_regex = pop_option(args, "--time-regex")
+            time_format = pop_option(args, "--time-format")
+            line_pattern = pop_option(args, "--mul")
+            cmd_index(args[1], time_regex, time_format, every, line_pattern)
+        elif action == "read":
+            time_from = pop_option(args, "--from")
+            time_to = pop_option(args, "--to")
+            cmd_read(args[1], time_from, time_to)
+        elif action == "cache":
+            cmd_cache(args[1] if len(args) > 1 else "stats", cache_size)
         elif action == "upgrade":
             cmd_upgrade()
         else:
             raise Exception("Unknown command.")
+    if cache_writer is not None:
+        with error_handler(action, {"Cache": CACHE_DIR}):
+            sys.stdout.flush()
+            cache_writer.commit()
+            result_cache.evict()